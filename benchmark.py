@@ -0,0 +1,146 @@
+"""
+Benchmarks for the storage and overlap-check paths of the Leave Management System.
+
+Usage:
+    python benchmark.py durability [--employees N] [--requests N]
+    python benchmark.py overlap [--employees N] [--leaves N] [--checks N]
+    python benchmark.py nlu [--queries N]
+"""
+import argparse
+from datetime import date
+import json
+import os
+import random
+import tempfile
+import time
+
+from leave_management_system import (
+    DEFAULT_NLU_EXAMPLES,
+    DURABILITY_LEVELS,
+    DURABILITY_NONE,
+    OVERLAP_ENGINES,
+    JsonFileStore,
+    LeaveManagementSystem,
+    SQLiteStore
+)
+
+STORES = {
+    "snapshot": lambda path, durability: JsonFileStore(path, durability=durability),
+    "journal": lambda path, durability: JsonFileStore(path, journal=True, durability=durability),
+    "sqlite": lambda path, durability: SQLiteStore(path + ".db", import_json_path=path, durability=durability)
+}
+
+
+def write_employees(path: str, count: int):
+    """Write an employees.json file with `count` employees."""
+    employees = {
+        f"Employee {i:07d}": {"Sick Leave": 10, "Annual Leave": 20, "Maternity Leave": 0}
+        for i in range(count)
+    }
+    with open(path, 'w') as file:
+        json.dump(employees, file, indent=4)
+
+
+def time_requests(lms: LeaveManagementSystem, requests: int) -> float:
+    """Return the mean latency in milliseconds of `requests` one-day leave requests."""
+    names = list(lms.employees.keys())
+    start = time.perf_counter()
+    for i in range(requests):
+        lms.request_leave(names[i % len(names)], "Annual Leave", 1, "2024-06-03")
+    return (time.perf_counter() - start) * 1000 / requests
+
+
+def bench_durability(employees: int, requests: int):
+    """Report the per-request cost of every store at every durability level."""
+    print(f"{employees} employees, {requests} requests per run")
+    print(f"{'store':<10} {'durability':<10} {'ms/request':>10}")
+    for store_name, make_store in STORES.items():
+        for durability in DURABILITY_LEVELS:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "employees.json")
+                write_employees(path, employees)
+                store = make_store(path, durability)
+                lms = LeaveManagementSystem(path, store=store, nlu_backend="local")
+                latency = time_requests(lms, requests)
+                store.close()
+            print(f"{store_name:<10} {durability:<10} {latency:>10.3f}")
+
+
+def bench_overlap(employees: int, leaves: int, checks: int):
+    """Report the per-check cost of every overlap engine against employees with `leaves` past leaves each."""
+    print(f"{employees} employees, {leaves} approved leaves each, {checks} checks per engine")
+    print(f"{'engine':<10} {'us/check':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "employees.json")
+        write_employees(path, employees)
+        with open(path, 'r') as file:
+            balances = json.load(file)
+        for name in balances:
+            balances[name]["Annual Leave"] = leaves * 2
+        with open(path, 'w') as file:
+            json.dump(balances, file)
+
+        # Book one two-day leave per week, going back from today
+        store = JsonFileStore(path, journal=True, durability=DURABILITY_NONE)
+        lms = LeaveManagementSystem(path, store=store, nlu_backend="local")
+        today = date.today().toordinal()
+        for name in lms.employees:
+            for week in range(leaves):
+                lms.request_leave(name, "Annual Leave", 2, date.fromordinal(today - 7 * week).isoformat())
+
+        rng = random.Random(0)
+        names = list(lms.employees)
+        probes = [(rng.choice(names), today - rng.randrange(7 * leaves)) for _ in range(checks)]
+        for engine_name, engine_class in OVERLAP_ENGINES.items():
+            engine = engine_class(store)
+            for name in names:
+                engine.has_overlap(name, today, today)
+            start = time.perf_counter()
+            for name, day in probes:
+                engine.has_overlap(name, day, day + 2)
+            latency = (time.perf_counter() - start) * 1e6 / checks
+            print(f"{engine_name:<10} {latency:>10.2f}")
+        store.close()
+
+
+def bench_nlu(queries: int):
+    """Report the per-query cost of the offline NLU backend on its own training phrasings."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "employees.json")
+        write_employees(path, 1)
+        lms = LeaveManagementSystem(path, nlu_backend="local")
+        texts = [text for text, _, _ in DEFAULT_NLU_EXAMPLES]
+        start = time.perf_counter()
+        for i in range(queries):
+            lms.nlu.parse(texts[i % len(texts)], "Employee 0000000")
+        latency = (time.perf_counter() - start) * 1e6 / queries
+    print(f"{queries} queries, offline backend: {latency:.1f} us/query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Leave Management System benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    durability = subparsers.add_parser("durability", help="cost of each store and durability level")
+    durability.add_argument("--employees", type=int, default=10000)
+    durability.add_argument("--requests", type=int, default=200)
+
+    overlap = subparsers.add_parser("overlap", help="cost of each overlap engine")
+    overlap.add_argument("--employees", type=int, default=200)
+    overlap.add_argument("--leaves", type=int, default=100)
+    overlap.add_argument("--checks", type=int, default=20000)
+
+    nlu = subparsers.add_parser("nlu", help="cost of the offline NLU backend")
+    nlu.add_argument("--queries", type=int, default=20000)
+
+    args = parser.parse_args()
+    if args.benchmark == "durability":
+        bench_durability(args.employees, args.requests)
+    elif args.benchmark == "overlap":
+        bench_overlap(args.employees, args.leaves, args.checks)
+    elif args.benchmark == "nlu":
+        bench_nlu(args.queries)
+
+
+if __name__ == "__main__":
+    main()
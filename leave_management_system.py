@@ -1,13 +1,2664 @@
-from datetime import datetime, timedelta
+from abc import ABC, abstractmethod
+from array import array
+import asyncio
+import bisect
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Mapping, MutableMapping, Sequence
+import contextlib
+import functools
+from datetime import date, datetime
+import hashlib
 import json
+import math
+import mmap
 from dotenv import load_dotenv
 import os
-from openai import OpenAI
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+from openai import AsyncOpenAI, OpenAI
 
 # Load environment variables from .env file
 load_dotenv()
 
 
+# Durability levels for persisted writes, from fastest to safest
+DURABILITY_NONE = "none"            # leave write-back to the operating system
+DURABILITY_FILE = "file"            # fsync every written file
+DURABILITY_DIRECTORY = "directory"  # also fsync the directory after creating or renaming files
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_FILE, DURABILITY_DIRECTORY)
+
+
+def validate_durability(durability: str) -> str:
+    """Return the durability level, raising ValueError for unknown levels."""
+    if durability not in DURABILITY_LEVELS:
+        raise ValueError(f"Invalid durability level: {durability}. Use one of: {', '.join(DURABILITY_LEVELS)}")
+    return durability
+
+
+def fsync_directory(path: str):
+    """Flush directory entry changes (creates and renames) for the directory containing `path`."""
+    # Directories cannot be opened for fsync on every platform (e.g. Windows)
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, durability: str = DURABILITY_FILE, mode: str = 'w'):
+    """Open a temporary file that is renamed over `path` on success, so a crash never leaves it half-written."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, mode) as file:
+            yield file
+            if durability != DURABILITY_NONE:
+                file.flush()
+                os.fsync(file.fileno())
+        # mkstemp creates owner-only files; keep the permissions of the file being replaced
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if durability == DURABILITY_DIRECTORY:
+        fsync_directory(path)
+
+
+def atomic_write_text(path: str, text: str, durability: str = DURABILITY_FILE):
+    """Replace a file's contents atomically (see atomic_open)."""
+    with atomic_open(path, durability) as file:
+        file.write(text)
+
+
+def append_text(path: str, text: str, durability: str = DURABILITY_FILE):
+    """Append to a file, syncing it (and its directory entry if newly created) per the durability level."""
+    created = not os.path.exists(path)
+    with open(path, 'a') as file:
+        file.write(text)
+        if durability != DURABILITY_NONE:
+            file.flush()
+            os.fsync(file.fileno())
+
+    if created and durability == DURABILITY_DIRECTORY:
+        fsync_directory(path)
+
+
+def employee_key(employee_name: str) -> str:
+    """Return a stable, filesystem-safe key for an employee name."""
+    return hashlib.blake2b(employee_name.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def leave_end_ordinal(start_ordinal: int, days: int | float) -> int:
+    """Return the day ordinal of the last day of a leave (the start day counts as the first day)."""
+    return start_ordinal + int(days) - 1
+
+
+def format_ordinal(ordinal: int) -> str:
+    """Format a day ordinal as YYYY-MM-DD for display and export."""
+    return date.fromordinal(ordinal).isoformat()
+
+
+class DateParser:
+    """
+    Parse YYYY-MM-DD, YYYY.MM.DD, DD-MM-YYYY, DD.MM.YYYY and 'today' into day ordinals.
+
+    The format is picked from the separator and the position of the four-digit year,
+    so each string is split once instead of being tried against every strptime format.
+    Results are memoized in a bounded LRU cache; 'today' is resolved once per calendar day.
+    """
+
+    def __init__(self, cache_size: int = 65536):
+        self._parse_cached = functools.lru_cache(maxsize=cache_size)(self._parse)
+        self._today = None
+        self._tomorrow_at = 0.0
+
+    def today(self) -> int:
+        """Return today's day ordinal, recomputed only after midnight."""
+        if time.time() >= self._tomorrow_at:
+            self._today = date.today().toordinal()
+            self._tomorrow_at = datetime.fromordinal(self._today + 1).timestamp()
+        return self._today
+
+    def parse(self, date_str: str) -> int | None:
+        """Return the day ordinal of `date_str`, or None if it is not a valid date in an accepted format."""
+        if not isinstance(date_str, str):
+            return None
+        if date_str.lower() == 'today':
+            return self.today()
+        return self._parse_cached(date_str)
+
+    @staticmethod
+    def _parse(date_str: str) -> int | None:
+        parts = date_str.split('-' if '-' in date_str else '.')
+        if len(parts) != 3 or not all(part.isascii() and part.isdigit() for part in parts):
+            return None
+        if len(parts[0]) == 4 and len(parts[1]) <= 2 and len(parts[2]) <= 2:
+            year, month, day = parts
+        elif len(parts[2]) == 4 and len(parts[0]) <= 2 and len(parts[1]) <= 2:
+            day, month, year = parts
+        else:
+            return None
+        try:
+            return date(int(year), int(month), int(day)).toordinal()
+        except ValueError:
+            return None
+
+    def cache_info(self):
+        """Return the hit/miss statistics of the memo cache."""
+        return self._parse_cached.cache_info()
+
+
+class GroupCommitter:
+    """
+    Coalesces commits from concurrent callers into a single flush.
+
+    The first caller of a batch becomes its leader: it waits until `window` seconds have
+    passed or `max_batch` callers have joined, then flushes once on behalf of everyone.
+    Every caller returns only after a flush covering its changes has finished.
+    """
+
+    def __init__(self, flush: Callable[[], bool], window: float = 0.005, max_batch: int = 64):
+        self._flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._open_batch = 0
+        self._open_count = 0
+        self._flushed_batch = -1
+        # Followers still to be told the outcome of each closed batch, and the batches that failed
+        self._waiting = {}
+        self._failed_batches = set()
+
+    def commit(self) -> bool:
+        """Wait until the caller's changes are flushed. Returns False if that flush failed."""
+        with self._cond:
+            batch = self._open_batch
+            self._open_count += 1
+
+            if self._open_count > 1:
+                # Follower: wake the leader early once the batch is full, then wait for its flush
+                if self._open_count >= self.max_batch:
+                    self._cond.notify_all()
+                while self._flushed_batch < batch:
+                    self._cond.wait()
+                failed = batch in self._failed_batches
+                # The last follower to read a batch's outcome forgets it
+                self._waiting[batch] -= 1
+                if not self._waiting[batch]:
+                    del self._waiting[batch]
+                    self._failed_batches.discard(batch)
+                return not failed
+
+            # Leader: collect followers until the window closes or the batch is full
+            deadline = time.monotonic() + self.window
+            while self._open_count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Close the batch; later callers start the next one
+            if self._open_count > 1:
+                self._waiting[batch] = self._open_count - 1
+            self._open_batch += 1
+            self._open_count = 0
+
+        success = False
+        try:
+            with self._flush_lock:
+                success = self._flush()
+        except Exception as e:
+            print(f"Error saving state: {str(e)}")
+        finally:
+            # Followers must always be released, whether or not the flush went through
+            with self._cond:
+                if not success:
+                    # The flush covered every batch still waiting up to this one
+                    self._failed_batches.update(
+                        covered for covered in range(self._flushed_batch + 1, batch + 1) if covered in self._waiting
+                    )
+                # A later batch may have flushed first, and its flush also covered this batch
+                self._flushed_batch = max(self._flushed_batch, batch)
+                self._cond.notify_all()
+        return success
+
+
+class StorageBackend:
+    """
+    Base class for persisting employee balances and leave history.
+
+    `employees` maps employee names to {leave type: balance} and `leave_history` maps
+    employee names to lists of leave records. A record holds its "type", "days" and
+    "status", and its "start", "end" and "requested" dates as integer day ordinals;
+    dates are only formatted as strings for output. Both are read through the mapping
+    interface; all changes go through the methods below so a backend can record them.
+    Callers hold `lock_for(employee)` while they check and change an employee's state,
+    and call `commit` afterwards.
+    Employees whose balances changed since the last flush are tracked in `dirty`.
+    """
+
+    def __init__(self):
+        self.employees = {}
+        self.leave_history = {}
+        self.dirty = set()
+        self.lock = threading.RLock()
+        self.group_committer = None
+
+    def enable_group_commit(self, window: float = 0.005, max_batch: int = 64):
+        """Coalesce commits arriving within `window` seconds, or up to `max_batch` of them, into one flush."""
+        self.group_committer = GroupCommitter(self.flush, window, max_batch)
+
+    def lock_for(self, employee_name: str) -> threading.RLock:
+        """Return the lock guarding an employee's balances and history."""
+        return self.lock
+
+    def set_balance(self, employee_name: str, leave_type: str, balance: int | float):
+        """Set the balance of one leave type for an employee."""
+        self.employees[employee_name][leave_type] = balance
+        self.dirty.add(employee_name)
+
+    def add_leave(self, employee_name: str, record: dict):
+        """Append a leave record to an employee's history."""
+        self.leave_history[employee_name].append(record)
+
+    def set_leave_status(self, employee_name: str, record: dict, status: str):
+        """Change the status of a leave record previously returned by this backend."""
+        record["status"] = status
+
+    def find_leaves(self, employee_name: str, status: str, leave_type: str | None = None,
+                    start: int | None = None) -> list[dict]:
+        """Return an employee's leave records with the given status, optionally filtered by type and start day."""
+        return [
+            leave for leave in self.leave_history[employee_name]
+            if leave["status"] == status
+            and (leave_type is None or leave["type"] == leave_type)
+            and (start is None or leave["start"] == start)
+        ]
+
+    def iter_approved_leaves(self) -> Iterable[tuple[str, int, int]]:
+        """Yield (employee name, start, end) for every approved leave in the organisation."""
+        for employee_name in self.employees:
+            for leave in self.find_leaves(employee_name, "approved"):
+                yield employee_name, leave["start"], leave["end"]
+
+    def has_overlap(self, employee_name: str, start: int, end: int) -> bool:
+        """Check if the inclusive period of day ordinals overlaps any approved leave of the employee."""
+        for leave in self.find_leaves(employee_name, "approved"):
+            if start <= leave["end"] and leave["start"] <= end:
+                return True
+
+        return False
+
+    def commit(self) -> bool:
+        """Make all changes since the last commit durable. Returns False if saving failed."""
+        if self.group_committer is not None:
+            return self.group_committer.commit()
+        return self.flush()
+
+    def flush(self) -> bool:
+        """Write out all pending changes. Returns False if saving failed."""
+        return True
+
+    def compact(self) -> bool:
+        """Rewrite the persisted state in its most compact form."""
+        return self.flush()
+
+    def close(self):
+        """Release any resources held by the backend."""
+
+
+class HistoryLog:
+    """
+    Append-only leave history stored as one small file per employee.
+
+    Each line is a tab-separated record with dates as integer day ordinals:
+    `A <type> <days> <start> <requested>` appends a leave and `S <index> <status>`
+    changes the status of the leave at that position. Files are only read when an
+    employee's history is first needed, so start-up cost does not grow with history.
+    """
+
+    def __init__(self, directory: str, durability: str = DURABILITY_FILE):
+        self.directory = directory
+        self.durability = validate_durability(durability)
+
+    def path_for(self, employee_name: str) -> str:
+        """Return the history file of an employee."""
+        return os.path.join(self.directory, employee_key(employee_name) + ".hist")
+
+    def load(self, employee_name: str) -> list[dict]:
+        """Read an employee's leave records, repairing a torn trailing record if present."""
+        path = self.path_for(employee_name)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+
+        # A crash mid-append leaves a partial last line; drop it so new records start cleanly
+        if data and not data.endswith(b"\n"):
+            data = data[:data.rfind(b"\n") + 1]
+            with open(path, 'r+b') as file:
+                file.truncate(len(data))
+
+        records = []
+        for line in data.decode("utf-8").splitlines():
+            fields = line.split("\t")
+            if fields[0] == "A":
+                _, leave_type, days, start, requested = fields
+                days = float(days) if "." in days else int(days)
+                records.append({
+                    "type": leave_type,
+                    "days": days,
+                    "start": int(start),
+                    "end": leave_end_ordinal(int(start), days),
+                    "status": "approved",
+                    "requested": int(requested)
+                })
+            elif fields[0] == "S":
+                records[int(fields[1])]["status"] = fields[2]
+        return records
+
+    @staticmethod
+    def leave_line(record: dict) -> str:
+        """Encode a new leave record as a history line."""
+        return f"A\t{record['type']}\t{record['days']}\t{record['start']}\t{record['requested']}\n"
+
+    @staticmethod
+    def status_line(index: int, status: str) -> str:
+        """Encode a status change of the leave at `index` as a history line."""
+        return f"S\t{index}\t{status}\n"
+
+    def size(self, employee_name: str) -> int:
+        """Return the size in bytes of an employee's history file."""
+        try:
+            return os.path.getsize(self.path_for(employee_name))
+        except FileNotFoundError:
+            return 0
+
+    def append(self, lines_by_employee: dict[str, list[str]], offsets: dict[str, int] | None = None):
+        """
+        Append encoded lines to the history files of the given employees.
+
+        Each employee's lines (and offset) are removed from the dicts as soon as their file
+        is written, so after a failure part-way only the unwritten employees stay pending.
+        """
+        for employee_name in list(lines_by_employee):
+            offset = offsets.get(employee_name) if offsets else None
+            self.write_at(employee_name, "".join(lines_by_employee[employee_name]), offset)
+            del lines_by_employee[employee_name]
+            if offsets:
+                offsets.pop(employee_name, None)
+
+    def write_at(self, employee_name: str, text: str, offset: int | None = None):
+        """
+        Append `text` to an employee's history file, starting at byte `offset`.
+
+        A file that already holds `text` at `offset` is left alone and anything else past
+        it (a torn earlier attempt) is cut off first, so replaying a write is idempotent.
+        A failed write is rolled back so it never leaves a partial line behind.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            if self.durability == DURABILITY_DIRECTORY:
+                fsync_directory(self.directory)
+
+        path = self.path_for(employee_name)
+        data = text.encode("utf-8")
+        size = self.size(employee_name)
+        if offset is None:
+            offset = size
+        elif size > offset:
+            with open(path, 'r+b') as file:
+                file.seek(offset)
+                if file.read(len(data)) == data:
+                    return
+                file.truncate(offset)
+
+        try:
+            append_text(path, text, self.durability)
+        except Exception:
+            try:
+                with open(path, 'r+b') as file:
+                    file.truncate(offset)
+            except OSError:
+                pass
+            raise
+
+
+class CommitLog:
+    """
+    Write-ahead log tying a commit's balances to its history lines.
+
+    Before a store writes anything for a commit that adds history, it appends one record
+    holding the new balances of the changed employees and their new history lines, each
+    with the history file offset it starts at. Once the store's own files and the
+    HistoryLog are written the log is emptied. After a crash, `replay` redoes the history
+    appends of the records left behind and returns their balances for the store to write.
+    A torn trailing record belongs to a commit that wrote nothing else, so it is dropped.
+    """
+
+    def __init__(self, path: str, history_log: HistoryLog, durability: str = DURABILITY_FILE):
+        self.path = path
+        self.history_log = history_log
+        self.durability = validate_durability(durability)
+        self.offsets = {}
+        self._recorded = False
+
+    def record(self, balances: Mapping[str, Mapping], history: Mapping[str, list[str]]):
+        """Append one commit's new balances and pending history lines as a single record."""
+        for employee_name in history:
+            # A retried append must start where the first attempt did
+            self.offsets.setdefault(employee_name, self.history_log.size(employee_name))
+        record = {
+            "s": {name: dict(employee_balances) for name, employee_balances in balances.items()},
+            "h": {name: [self.offsets[name], "".join(lines)] for name, lines in history.items()}
+        }
+        append_text(self.path, json.dumps(record, separators=(",", ":")) + "\n", self.durability)
+        self._recorded = True
+
+    def finish(self, history: dict[str, list[str]]):
+        """Write the recorded history lines, then empty the log; failed lines stay pending."""
+        if history:
+            self.history_log.append(history, self.offsets)
+        if self._recorded:
+            open(self.path, 'w').close()
+            self._recorded = False
+
+    def replay(self) -> dict[str, dict]:
+        """Redo the history of commits a crash cut short and return their latest balances."""
+        balances = {}
+        try:
+            file = open(self.path, 'r')
+        except FileNotFoundError:
+            return balances
+        with file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                balances.update(record["s"])
+                for employee_name, (offset, text) in record["h"].items():
+                    self.history_log.write_at(employee_name, text, offset)
+                self._recorded = True
+        return balances
+
+
+class LazyHistory(Mapping):
+    """Mapping of employee names to leave records, loaded from a HistoryLog on first access."""
+
+    def __init__(self, log: HistoryLog, employees: Mapping):
+        self._log = log
+        self._employees = employees
+        self._loaded = {}
+
+    def __getitem__(self, employee_name: str) -> list[dict]:
+        records = self._loaded.get(employee_name)
+        if records is None:
+            if employee_name not in self._employees:
+                raise KeyError(employee_name)
+            records = self._loaded[employee_name] = self._log.load(employee_name)
+        return records
+
+    def __contains__(self, employee_name) -> bool:
+        return employee_name in self._employees
+
+    def __iter__(self):
+        return iter(self._employees)
+
+    def __len__(self) -> int:
+        return len(self._employees)
+
+
+class BalanceRow(MutableMapping):
+    """Dict-like view of one employee's balances in a BalanceTable or BinarySnapshot."""
+
+    def __init__(self, table, row: int):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, leave_type: str) -> int | float:
+        value = self._table.get(self._row, self._table.column(leave_type))
+        if value is None:
+            raise KeyError(leave_type)
+        return value
+
+    def __setitem__(self, leave_type: str, balance: int | float):
+        self._table.set(self._row, self._table.column(leave_type), balance)
+
+    def __delitem__(self, leave_type: str):
+        self[leave_type]
+        self._table.set(self._row, self._table.column(leave_type), None)
+
+    def __iter__(self):
+        for column, leave_type in enumerate(self._table.leave_types):
+            if self._table.get(self._row, column) is not None:
+                yield leave_type
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class BalanceTable(Mapping):
+    """
+    In-memory balance matrix: one row per employee and one column per leave type.
+
+    Balances live in one flat array of doubles (NaN where an employee has no balance of
+    a type) with a name-to-row index, instead of a dict per employee. Rows are exposed
+    as BalanceRow views, and whole columns can be sliced out and aggregated at once.
+    """
+
+    def __init__(self, leave_types: Iterable[str]):
+        self.leave_types = list(leave_types)
+        self._columns = {leave_type: column for column, leave_type in enumerate(self.leave_types)}
+        self._rows = {}
+        self._names = []
+        self._values = array("d")
+        self._missing = 0
+
+    @classmethod
+    def from_mapping(cls, employees: Mapping) -> "BalanceTable":
+        """Build a table from a mapping of employee names to {leave type: balance}."""
+        leave_types = {}
+        for balances in employees.values():
+            for leave_type in balances:
+                leave_types.setdefault(leave_type)
+        table = cls(leave_types)
+        for name, balances in employees.items():
+            table.add(name, balances)
+        return table
+
+    def add(self, employee_name: str, balances: Mapping):
+        """Append a row for a new employee."""
+        if employee_name in self._rows:
+            raise ValueError(f"Employee {employee_name} already exists")
+        row = len(self._names)
+        self._rows[employee_name] = row
+        self._names.append(employee_name)
+        self._values.extend([math.nan] * len(self.leave_types))
+        self._missing += len(self.leave_types)
+        for leave_type, balance in balances.items():
+            self.set(row, self.column(leave_type), balance)
+
+    def row(self, employee_name: str) -> int | None:
+        """Return an employee's row, or None if the employee does not exist."""
+        return self._rows.get(employee_name)
+
+    def column(self, leave_type: str) -> int:
+        """Return the column of a leave type, raising KeyError for unknown types."""
+        return self._columns[leave_type]
+
+    def get(self, row: int, column: int) -> int | float | None:
+        """Return one balance, or None if the employee has no balance of that type."""
+        value = self._values[row * len(self.leave_types) + column]
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+
+    def set(self, row: int, column: int, balance: int | float | None):
+        """Set one balance; None removes it."""
+        index = row * len(self.leave_types) + column
+        self._missing += (balance is None) - math.isnan(self._values[index])
+        self._values[index] = math.nan if balance is None else balance
+
+    def column_values(self, leave_type: str) -> array:
+        """Return every employee's balance of a leave type, in row order (NaN where missing)."""
+        return self._values[self.column(leave_type)::len(self.leave_types)]
+
+    def to_json(self) -> str:
+        """
+        Return the balances as the indented JSON `json.dumps(..., indent=4)` writes for the
+        equivalent dicts, built straight from the array without a dict per employee.
+        """
+        encode = json.encoder.encode_basestring_ascii
+        width = len(self.leave_types)
+        keys = [f"        {encode(leave_type)}: " for leave_type in self.leave_types]
+        values = self._values
+        employees = []
+        for row, name in enumerate(self._names):
+            # NaN marks a missing balance and is the only value not equal to itself
+            fields = [
+                key + (str(int(value)) if value.is_integer() else repr(value))
+                for key, value in zip(keys, values[row * width:(row + 1) * width]) if value == value
+            ]
+            balances = "{\n" + ",\n".join(fields) + "\n    }" if fields else "{}"
+            employees.append(f"    {encode(name)}: {balances}")
+        return "{\n" + ",\n".join(employees) + "\n}" if employees else "{}"
+
+    def column_total(self, leave_type: str) -> float:
+        """Return the sum of all employees' balances of a leave type."""
+        values = self.column_values(leave_type)
+        if self._missing:
+            return math.fsum(value for value in values if not math.isnan(value))
+        return math.fsum(values)
+
+    def __getitem__(self, employee_name: str) -> BalanceRow:
+        row = self._rows.get(employee_name)
+        if row is None:
+            raise KeyError(employee_name)
+        return BalanceRow(self, row)
+
+    def __contains__(self, employee_name) -> bool:
+        return employee_name in self._rows
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class _RowNames(Sequence):
+    """Sorted employee names of a BinarySnapshot as a sequence, decoded on demand for bisect."""
+
+    def __init__(self, snapshot: "BinarySnapshot"):
+        self._snapshot = snapshot
+
+    def __getitem__(self, row: int) -> str:
+        return self._snapshot._name(row)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+
+class BinarySnapshot(Mapping):
+    """
+    Employee balances in a memory-mapped binary snapshot file.
+
+    Layout (little-endian): a header, the interned leave-type names, the employee names
+    in sorted order with an offset table for binary search, and a row-major matrix of
+    float64 balances with one column per leave type (NaN where an employee has no such
+    balance). The file is mapped copy-on-write, so opening it costs the same for any
+    headcount and balance changes stay in memory until `save`.
+    """
+
+    MAGIC = b"LMSBIN01"
+    HEADER = struct.Struct("<8sIIQQQQ")  # magic, leave types, reserved, employees, and the offsets of
+                                         # the name offset table, the name blob and the balance matrix
+    OFFSET = struct.Struct("<Q")
+    VALUE = struct.Struct("<d")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._map = None
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self.path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Employee data file not found: {self.path}")
+        except ValueError:
+            raise ValueError(f"Invalid binary snapshot: {self.path}")
+
+        if len(self._map) < self.HEADER.size:
+            raise ValueError(f"Invalid binary snapshot: {self.path}")
+        magic, type_count, _, self._count, self._offsets_at, self._names_at, self._values_at = \
+            self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"Invalid binary snapshot: {self.path}")
+
+        # The leave-type table is tiny; decode it once
+        position = self.HEADER.size
+        self.leave_types = []
+        for _ in range(type_count):
+            (length,) = struct.unpack_from("<H", self._map, position)
+            self.leave_types.append(self._map[position + 2:position + 2 + length].decode("utf-8"))
+            position += 2 + length
+        self._columns = {leave_type: column for column, leave_type in enumerate(self.leave_types)}
+        self._row_size = type_count * self.VALUE.size
+
+    @classmethod
+    def encode(cls, employees: Mapping) -> bytes:
+        """Serialise a mapping of employee names to {leave type: balance} into the snapshot format."""
+        leave_types = {}
+        for balances in employees.values():
+            for leave_type in balances:
+                leave_types.setdefault(leave_type, len(leave_types))
+
+        names = sorted(employees)
+        encoded_names = [name.encode("utf-8") for name in names]
+        type_table = b"".join(
+            struct.pack("<H", len(leave_type.encode("utf-8"))) + leave_type.encode("utf-8")
+            for leave_type in leave_types
+        )
+
+        name_offsets = array("Q", [0])
+        for encoded in encoded_names:
+            name_offsets.append(name_offsets[-1] + len(encoded))
+        values = array("d", [math.nan]) * (len(names) * len(leave_types))
+        for row, name in enumerate(names):
+            for leave_type, balance in employees[name].items():
+                values[row * len(leave_types) + leave_types[leave_type]] = balance
+        if sys.byteorder != "little":
+            name_offsets.byteswap()
+            values.byteswap()
+
+        offsets_at = cls.HEADER.size + len(type_table)
+        names_at = offsets_at + len(name_offsets) * name_offsets.itemsize
+        name_blob = b"".join(encoded_names)
+        values_at = names_at + len(name_blob)
+        values_at += -values_at % 8  # keep the matrix 8-byte aligned
+        header = cls.HEADER.pack(cls.MAGIC, len(leave_types), 0, len(names), offsets_at, names_at, values_at)
+
+        return b"".join([
+            header, type_table, name_offsets.tobytes(), name_blob,
+            bytes(values_at - names_at - len(name_blob)), values.tobytes()
+        ])
+
+    @classmethod
+    def write(cls, path: str, employees: Mapping, durability: str = DURABILITY_FILE):
+        """Write a binary snapshot of the given employees to `path` atomically."""
+        data = cls.encode(employees)
+        with atomic_open(path, durability, 'wb') as file:
+            file.write(data)
+
+    def save(self, durability: str = DURABILITY_FILE):
+        """Write the current balances back to the snapshot file."""
+        # The copy-on-write mapping already holds the file with every change applied
+        data = bytes(self._map)
+        # The mapping must be released before the file is replaced (required on Windows)
+        self.close()
+        try:
+            with atomic_open(self.path, durability, 'wb') as file:
+                file.write(data)
+        finally:
+            self._open()
+
+    def close(self):
+        """Release the memory map."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _name(self, row: int) -> str:
+        start, end = struct.unpack_from("<QQ", self._map, self._offsets_at + row * self.OFFSET.size)
+        return self._map[self._names_at + start:self._names_at + end].decode("utf-8")
+
+    def row(self, employee_name: str) -> int | None:
+        """Binary-search the sorted name table. Returns the employee's row or None."""
+        row = bisect.bisect_left(_RowNames(self), employee_name)
+        if row < self._count and self._name(row) == employee_name:
+            return row
+        return None
+
+    def column(self, leave_type: str) -> int:
+        """Return the column of a leave type, raising KeyError for unknown types."""
+        return self._columns[leave_type]
+
+    def column_values(self, leave_type: str) -> array:
+        """Return every employee's balance of a leave type, in name order (NaN where missing)."""
+        values = array("d", self._map[self._values_at:self._values_at + self._count * self._row_size])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values[self.column(leave_type)::len(self.leave_types)]
+
+    def column_total(self, leave_type: str) -> float:
+        """Return the sum of all employees' balances of a leave type."""
+        return math.fsum(value for value in self.column_values(leave_type) if not math.isnan(value))
+
+    def get(self, row: int, column: int) -> int | float | None:
+        """Return one balance, or None if the employee has no balance of that type."""
+        (value,) = self.VALUE.unpack_from(self._map, self._values_at + row * self._row_size + column * self.VALUE.size)
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+
+    def set(self, row: int, column: int, balance: int | float | None):
+        """Set one balance in memory; None removes it."""
+        self.VALUE.pack_into(
+            self._map, self._values_at + row * self._row_size + column * self.VALUE.size,
+            math.nan if balance is None else balance
+        )
+
+    def __getitem__(self, employee_name: str) -> BalanceRow:
+        row = self.row(employee_name)
+        if row is None:
+            raise KeyError(employee_name)
+        return BalanceRow(self, row)
+
+    def __contains__(self, employee_name) -> bool:
+        return self.row(employee_name) is not None
+
+    def __iter__(self):
+        for row in range(self._count):
+            yield self._name(row)
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class LazyJsonEmployees(Mapping):
+    """
+    Read-only-keys mapping over a large employees.json that parses records on first access.
+
+    The file is memory-mapped and scanned once to build an offset index of every
+    top-level employee record, which is kept next to it in `<path>.idx` and reused while
+    the file is unchanged. Lookups binary-search the index, so start-up does not parse
+    any employee, and only the balances actually touched are held in memory.
+    """
+
+    INDEX_MAGIC = b"LMSIDX01"
+    INDEX_HEADER = struct.Struct("<8sQqQ")  # magic, source size, source mtime_ns, count
+    INDEX_ENTRY = struct.Struct("<QIQI")    # key offset, key length, value offset, value length
+    INDEX_ORDER = struct.Struct("<I")       # entry number, in name order
+    TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+
+    def __init__(self, json_file_path: str):
+        self.json_file_path = json_file_path
+        self.index_path = json_file_path + ".idx"
+        self._loaded = {}
+        self._source = None
+        self._index = None
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self.json_file_path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    raise ValueError(f"Invalid JSON format in file: {self.json_file_path}")
+                self._source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Employee data file not found: {self.json_file_path}")
+
+        stat = os.stat(self.json_file_path)
+        if not self._open_index(stat):
+            entries = self._scan()
+            names = [self._decode_key(key_offset, key_length) for key_offset, key_length, _, _ in entries]
+            self._write_index(entries, names, stat)
+            self._open_index(stat)
+
+    def _open_index(self, stat: os.stat_result) -> bool:
+        """Map the sidecar index if it matches the current file. Returns False if it must be rebuilt."""
+        try:
+            with open(self.index_path, 'rb') as file:
+                index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        if len(index) < self.INDEX_HEADER.size:
+            index.close()
+            return False
+        magic, size, mtime_ns, count = self.INDEX_HEADER.unpack_from(index, 0)
+        if magic != self.INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            index.close()
+            return False
+
+        self._index = index
+        self._count = count
+        self._order_offset = self.INDEX_HEADER.size + count * self.INDEX_ENTRY.size
+        return True
+
+    def _scan(self) -> list[tuple[int, int, int, int]]:
+        """Find the key and value span of every top-level employee record."""
+        entries = []
+        depth = 0
+        key = None
+        value_start = 0
+        for match in self.TOKEN.finditer(self._source):
+            token = match.group()
+            if token[0] == 0x22:  # '"'
+                if depth == 1:
+                    key = match
+                continue
+            if token in (b"{", b"["):
+                depth += 1
+                if depth == 2:
+                    if key is None:
+                        raise ValueError(f"Invalid JSON format in file: {self.json_file_path}")
+                    value_start = match.start()
+            else:
+                depth -= 1
+                if depth == 1:
+                    entries.append((key.start(), key.end() - key.start(), value_start, match.end() - value_start))
+                    key = None
+                elif depth < 0:
+                    raise ValueError(f"Invalid JSON format in file: {self.json_file_path}")
+
+        if depth != 0 or key is not None:
+            raise ValueError(f"Invalid JSON format in file: {self.json_file_path}")
+        return entries
+
+    def _write_index(self, entries: list[tuple[int, int, int, int]], names: list[str], stat: os.stat_result):
+        """Write the sidecar index for the given entries and their names, both in file order."""
+        order = sorted(range(len(entries)), key=names.__getitem__)
+        with atomic_open(self.index_path, DURABILITY_NONE, 'wb') as file:
+            file.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(entries)))
+            for entry in entries:
+                file.write(self.INDEX_ENTRY.pack(*entry))
+            for number in order:
+                file.write(self.INDEX_ORDER.pack(number))
+
+    def _entry(self, number: int) -> tuple[int, int, int, int]:
+        return self.INDEX_ENTRY.unpack_from(self._index, self.INDEX_HEADER.size + number * self.INDEX_ENTRY.size)
+
+    def _decode_key(self, key_offset: int, key_length: int) -> str:
+        raw = self._source[key_offset:key_offset + key_length]
+        return raw[1:-1].decode("utf-8") if b"\\" not in raw else json.loads(raw)
+
+    def _find(self, employee_name: str) -> int | None:
+        """Binary-search the index for an employee. Returns the entry number or None."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            number = self.INDEX_ORDER.unpack_from(self._index, self._order_offset + middle * self.INDEX_ORDER.size)[0]
+            key_offset, key_length, _, _ = self._entry(number)
+            name = self._decode_key(key_offset, key_length)
+            if name == employee_name:
+                return number
+            if name < employee_name:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __getitem__(self, employee_name: str) -> dict:
+        balances = self._loaded.get(employee_name)
+        if balances is None:
+            number = self._find(employee_name)
+            if number is None:
+                raise KeyError(employee_name)
+            _, _, value_offset, value_length = self._entry(number)
+            try:
+                balances = json.loads(self._source[value_offset:value_offset + value_length])
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON format in file: {self.json_file_path}")
+            self._loaded[employee_name] = balances
+        return balances
+
+    def __contains__(self, employee_name) -> bool:
+        return employee_name in self._loaded or self._find(employee_name) is not None
+
+    def __iter__(self):
+        for number in range(self._count):
+            key_offset, key_length, _, _ = self._entry(number)
+            yield self._decode_key(key_offset, key_length)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def write_snapshot(self, durability: str = DURABILITY_FILE):
+        """
+        Rewrite the JSON file with the current balances, copying untouched records verbatim.
+
+        The new offset index is computed while writing, so the file never needs rescanning.
+        """
+        entries, names = [], []
+        with atomic_open(self.json_file_path, durability, 'wb') as file:
+            position = file.write(b"{\n")
+            for number in range(self._count):
+                key_offset, key_length, value_offset, value_length = self._entry(number)
+                name = self._decode_key(key_offset, key_length)
+                if name in self._loaded:
+                    value = json.dumps(self._loaded[name], indent=4).replace("\n", "\n    ").encode("utf-8")
+                else:
+                    value = self._source[value_offset:value_offset + value_length]
+                separator = b",\n    " if number else b"    "
+                key = self._source[key_offset:key_offset + key_length]
+                position += file.write(separator)
+                names.append(name)
+                entries.append((position, len(key), position + len(key) + 2, len(value)))
+                position += file.write(key + b": " + value)
+            file.write(b"\n}")
+
+            # The old mappings must be released before the file is replaced (required on Windows)
+            self.close()
+
+        self._write_index(entries, names, os.stat(self.json_file_path))
+        self._open()
+
+    def close(self):
+        """Release the memory maps of the file and its index."""
+        for mapped in (self._source, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._source = self._index = None
+
+
+class JsonFileStore(StorageBackend):
+    """
+    Stores balances in a JSON snapshot file.
+
+    In journal mode each commit appends one compact record of its balance changes to
+    `<json_file_path>.log` instead of rewriting the snapshot; the log is replayed on
+    start-up and folded back into the snapshot once it grows past `compact_threshold`.
+    Leave history is appended to a HistoryLog in `<json_file_path>.history` and loaded
+    per employee on first access. New history lines travel in the same log record as
+    the balance changes and are only appended to the HistoryLog once that record is
+    written, so replaying the log always brings balances and history back in step.
+    Without a journal the log is written only for commits that carry history, and is
+    emptied again once the snapshot and the history files are both written.
+
+    Snapshots are written to a temporary file and renamed over the old one, and
+    `durability` selects how far each write is synced (see DURABILITY_LEVELS).
+
+    With `lazy=True` the file is not parsed up front; employees are read on first access
+    through a LazyJsonEmployees offset index. This pairs best with journal mode, where
+    the snapshot is only rewritten on compaction.
+
+    `snapshot_format` selects what snapshots are written as: "json", "binary" (a
+    memory-mapped BinarySnapshot in `<json_file_path>.bin`) or "both". With a binary
+    format the .bin file is loaded when present, and employees.json is only imported
+    when it is missing; `export_json` writes the current balances back out as JSON.
+    """
+
+    SNAPSHOT_FORMATS = ("json", "binary", "both")
+
+    def __init__(self, json_file_path: str, journal: bool = False, compact_threshold: int = 1000,
+                 history_dir: str | None = None, durability: str = DURABILITY_FILE, lazy: bool = False,
+                 snapshot_format: str = "json"):
+        super().__init__()
+        self.json_file_path = json_file_path
+        self.durability = validate_durability(durability)
+        if snapshot_format not in self.SNAPSHOT_FORMATS:
+            raise ValueError(f"Invalid snapshot format: {snapshot_format}. "
+                             f"Use one of: {', '.join(self.SNAPSHOT_FORMATS)}")
+        if lazy and snapshot_format != "json":
+            raise ValueError("Lazy loading is only available for JSON snapshots")
+        self.lazy = lazy
+        self.snapshot_format = snapshot_format
+        self.binary_path = json_file_path + ".bin"
+
+        if snapshot_format != "json" and os.path.exists(self.binary_path):
+            self.employees = BinarySnapshot(self.binary_path)
+        elif lazy:
+            self.employees = LazyJsonEmployees(json_file_path)
+        else:
+            try:
+                # Load employee data from JSON file into a balance matrix
+                with open(json_file_path, 'r') as file:
+                    self.employees = BalanceTable.from_mapping(json.load(file))
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Employee data file not found: {json_file_path}")
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON format in file: {json_file_path}")
+
+            if snapshot_format != "json":
+                BinarySnapshot.write(self.binary_path, self.employees, self.durability)
+                self.employees = BinarySnapshot(self.binary_path)
+
+        # Store leave history
+        self.history_log = HistoryLog(history_dir or json_file_path + ".history", durability)
+        self.leave_history = LazyHistory(self.history_log, self.employees)
+        self._pending_history = {}
+        self._history_offsets = {}
+
+        self.journal = journal
+        self.journal_path = json_file_path + ".log"
+        self.compact_threshold = compact_threshold
+        self._journal_entries = 0
+        self._pending = []
+        self._replay_journal()
+
+    def set_balance(self, employee_name: str, leave_type: str, balance: int | float):
+        super().set_balance(employee_name, leave_type, balance)
+        # Self-contained [employee, type, balance] changes; replaying them is idempotent
+        self._pending.append([employee_name, leave_type, balance])
+
+    def add_leave(self, employee_name: str, record: dict):
+        super().add_leave(employee_name, record)
+        self._pending_history.setdefault(employee_name, []).append(HistoryLog.leave_line(record))
+
+    def set_leave_status(self, employee_name: str, record: dict, status: str):
+        super().set_leave_status(employee_name, record, status)
+        index = next(i for i, leave in enumerate(self.leave_history[employee_name]) if leave is record)
+        self._pending_history.setdefault(employee_name, []).append(HistoryLog.status_line(index, status))
+
+    def flush(self) -> bool:
+        with self.lock:
+            if self.journal:
+                if (self._pending or self._pending_history) and not self._record_batch():
+                    return False
+                self.dirty.clear()
+                if not self._append_history():
+                    return False
+                if self._journal_entries >= self.compact_threshold:
+                    return self.compact()
+                return True
+
+            if self._pending_history and not self._record_batch():
+                return False
+            self._pending = []
+            # Nothing to rewrite when no balance changed since the last snapshot
+            if self.dirty and not self.save_snapshot():
+                return False
+            return self._append_history() and self._truncate_journal()
+
+    def _record_batch(self) -> bool:
+        """Append the pending balance changes and history lines to the log as one record."""
+        for employee_name in self._pending_history:
+            # A retried append must start where the first attempt did
+            self._history_offsets.setdefault(employee_name, self.history_log.size(employee_name))
+        record = {}
+        if self._pending:
+            record["s"] = self._pending
+        if self._pending_history:
+            record["h"] = {name: [self._history_offsets[name], "".join(lines)]
+                           for name, lines in self._pending_history.items()}
+        try:
+            append_text(self.journal_path, json.dumps(record, separators=(",", ":")) + "\n", self.durability)
+        except Exception as e:
+            print(f"Error saving state: {str(e)}")
+            return False
+
+        self._journal_entries += len(self._pending) + sum(map(len, self._pending_history.values()))
+        self._pending = []
+        return True
+
+    def _append_history(self) -> bool:
+        """Write the recorded history lines to the HistoryLog; failed ones stay pending."""
+        if not self._pending_history:
+            return True
+        try:
+            self.history_log.append(self._pending_history, self._history_offsets)
+            return True
+        except Exception as e:
+            print(f"Error saving leave history: {str(e)}")
+            return False
+
+    def save_snapshot(self) -> bool:
+        """Save the current state of employees to the configured snapshot file(s)."""
+        with self.lock:
+            try:
+                if self.snapshot_format != "json":
+                    self.employees.save(self.durability)
+                if self.snapshot_format != "binary":
+                    self.export_json()
+                self.dirty.clear()
+                return True
+            except Exception as e:
+                print(f"Error saving state: {str(e)}")
+                return False
+
+    def export_json(self, path: str | None = None):
+        """Write the current balances as pretty-printed JSON, to employees.json by default."""
+        with self.lock:
+            if self.lazy and path is None:
+                self.employees.write_snapshot(self.durability)
+                return
+            if isinstance(self.employees, BalanceTable):
+                text = self.employees.to_json()
+            else:
+                text = json.dumps({name: dict(balances) for name, balances in self.employees.items()}, indent=4)
+            atomic_write_text(path or self.json_file_path, text, self.durability)
+
+    def compact(self) -> bool:
+        """Fold the journal into a fresh snapshot and start a new, empty journal."""
+        with self.lock:
+            # The journal is only truncated once the snapshot and history holding its changes are written
+            if self._pending_history and not self._record_batch():
+                return False
+            if not self.save_snapshot():
+                return False
+            self._pending = []
+            return self._append_history() and self._truncate_journal()
+
+    def _truncate_journal(self) -> bool:
+        """Empty the journal once everything it records is in the snapshot and history files."""
+        if not (self.journal or self._journal_entries):
+            return True
+        try:
+            open(self.journal_path, 'w').close()
+        except Exception as e:
+            print(f"Error compacting journal: {str(e)}")
+            return False
+        self._journal_entries = 0
+        return True
+
+    def _replay_journal(self):
+        """Apply journal records written since the last snapshot to the in-memory state."""
+        if not os.path.exists(self.journal_path):
+            return
+
+        torn_tail = False
+        with open(self.journal_path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-append leaves at most one partial trailing record
+                    torn_tail = True
+                    break
+                changes = record.get("s", [])
+                if "e" in record:
+                    # Older journals hold a single change per line
+                    changes = [[record["e"], record["t"], record["b"]]]
+                # Employees are never added at runtime, so every record names a known one
+                for employee_name, leave_type, balance in changes:
+                    if employee_name in self.employees:
+                        self.employees[employee_name][leave_type] = balance
+                # Redo history appends a crash may have cut short; already written ones are skipped
+                history = record.get("h", {})
+                for employee_name, (offset, text) in history.items():
+                    self.history_log.write_at(employee_name, text, offset)
+                self._journal_entries += len(changes) + sum(text.count("\n") for _, text in history.values())
+
+        # Compacting also drops a torn tail so new records never get appended after it;
+        # without a journal, anything left in the log is folded into the snapshot right away
+        if torn_tail or self._journal_entries >= self.compact_threshold or \
+                (not self.journal and self._journal_entries):
+            self.compact()
+
+    def close(self):
+        if self.lazy or self.snapshot_format != "json":
+            self.employees.close()
+
+
+class _KeyedEmployees(Mapping):
+    """Mapping of employee names to balances, read from per-employee files on first access."""
+
+    def __init__(self, store: "DirectoryStore"):
+        self._store = store
+        self._loaded = {}
+        self._names = None
+
+    def __getitem__(self, employee_name: str) -> dict:
+        balances = self._loaded.get(employee_name)
+        if balances is None:
+            try:
+                with open(self._store.path_for(employee_name), 'r') as file:
+                    balances = json.load(file)["balances"]
+            except FileNotFoundError:
+                raise KeyError(employee_name)
+            self._loaded[employee_name] = balances
+        return balances
+
+    def __contains__(self, employee_name) -> bool:
+        return employee_name in self._loaded or os.path.exists(self._store.path_for(employee_name))
+
+    def __iter__(self):
+        if self._names is None:
+            with open(self._store.manifest_path, 'r') as file:
+                self._names = file.read().splitlines()
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class DirectoryStore(StorageBackend):
+    """
+    Stores each employee's balances in its own small JSON file.
+
+    Balance changes only mark the employee dirty; a flush rewrites just the dirty
+    employees' files, so the bytes written per commit depend on what changed rather
+    than on the size of the organisation. Employee files are read on first access and
+    `employees.txt` lists all names. Leave history goes to a HistoryLog in `history/`;
+    commits that add history are first recorded in a CommitLog, `commit.log`, so a crash
+    cannot leave history and balances out of step.
+    """
+
+    def __init__(self, directory: str, import_json_path: str | None = None, durability: str = DURABILITY_FILE):
+        super().__init__()
+        self.directory = directory
+        self.durability = validate_durability(durability)
+        self.manifest_path = os.path.join(directory, "employees.txt")
+
+        # Seed a new directory from an existing employees.json export
+        if not os.path.exists(self.manifest_path):
+            if not import_json_path:
+                raise FileNotFoundError(f"Employee data directory not found: {directory}")
+            try:
+                with open(import_json_path, 'r') as file:
+                    employees = json.load(file)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Employee data file not found: {import_json_path}")
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON format in file: {import_json_path}")
+            self.import_employees(employees)
+
+        self.employees = _KeyedEmployees(self)
+        self.history_log = HistoryLog(os.path.join(directory, "history"), durability)
+        self.leave_history = LazyHistory(self.history_log, self.employees)
+        self._pending_history = {}
+
+        self.commit_log = CommitLog(os.path.join(directory, "commit.log"), self.history_log, durability)
+        for employee_name, balances in self.commit_log.replay().items():
+            self._write_employee(employee_name, balances, self.durability)
+        self.commit_log.finish({})
+
+    def path_for(self, employee_name: str) -> str:
+        """Return the balance file of an employee."""
+        return os.path.join(self.directory, "employees", employee_key(employee_name) + ".json")
+
+    def import_employees(self, employees: Mapping):
+        """Write one file per employee and the name manifest."""
+        os.makedirs(os.path.join(self.directory, "employees"), exist_ok=True)
+        for name, balances in employees.items():
+            self._write_employee(name, balances, DURABILITY_NONE)
+        atomic_write_text(self.manifest_path, "".join(name + "\n" for name in employees), self.durability)
+
+    def _write_employee(self, employee_name: str, balances: Mapping, durability: str):
+        atomic_write_text(
+            self.path_for(employee_name),
+            json.dumps({"name": employee_name, "balances": dict(balances)}, separators=(",", ":")),
+            durability
+        )
+
+    def add_leave(self, employee_name: str, record: dict):
+        super().add_leave(employee_name, record)
+        self._pending_history.setdefault(employee_name, []).append(HistoryLog.leave_line(record))
+
+    def set_leave_status(self, employee_name: str, record: dict, status: str):
+        super().set_leave_status(employee_name, record, status)
+        index = next(i for i, leave in enumerate(self.leave_history[employee_name]) if leave is record)
+        self._pending_history.setdefault(employee_name, []).append(HistoryLog.status_line(index, status))
+
+    def flush(self) -> bool:
+        with self.lock:
+            try:
+                if self._pending_history:
+                    self.commit_log.record(
+                        {name: self.employees[name] for name in self.dirty}, self._pending_history
+                    )
+
+                # Sync each file, then the shared directory once for the whole batch
+                file_durability = DURABILITY_NONE if self.durability == DURABILITY_NONE else DURABILITY_FILE
+                for employee_name in self.dirty:
+                    self._write_employee(employee_name, self.employees[employee_name], file_durability)
+                if self.dirty and self.durability == DURABILITY_DIRECTORY:
+                    fsync_directory(self.path_for(next(iter(self.dirty))))
+                self.dirty.clear()
+
+                self.commit_log.finish(self._pending_history)
+                return True
+            except Exception as e:
+                print(f"Error saving state: {str(e)}")
+                return False
+
+
+class _Shard:
+    """One shard of a ShardedJsonStore: a JSON file of employees plus its own lock, pending changes and CommitLog."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.employees = None
+        self.dirty = False
+        self.pending_history = {}
+        self.commit_log = None
+
+    def load(self) -> dict:
+        """Return the shard's employees, reading the shard file on first use."""
+        if self.employees is None:
+            with self.lock:
+                if self.employees is None:
+                    try:
+                        with open(self.path, 'r') as file:
+                            self.employees = json.load(file)
+                    except FileNotFoundError:
+                        self.employees = {}
+                    except json.JSONDecodeError:
+                        raise ValueError(f"Invalid JSON format in file: {self.path}")
+        return self.employees
+
+
+class _ShardedEmployees(Mapping):
+    """Mapping view over the employees of all shards, loading each shard on first access."""
+
+    def __init__(self, store: "ShardedJsonStore"):
+        self._store = store
+
+    def __getitem__(self, employee_name: str) -> dict:
+        return self._store.shard_for(employee_name).load()[employee_name]
+
+    def __contains__(self, employee_name) -> bool:
+        return employee_name in self._store.shard_for(employee_name).load()
+
+    def __iter__(self):
+        for shard in self._store.shards:
+            yield from list(shard.load())
+
+    def __len__(self) -> int:
+        return sum(len(shard.load()) for shard in self._store.shards)
+
+
+class ShardedJsonStore(StorageBackend):
+    """
+    Splits employees into `num_shards` JSON files by a hash of the employee name.
+
+    Every shard has its own lock, so requests for employees on different shards are
+    checked, applied and written concurrently, and a flush rewrites only the shards that
+    changed. Shards are read on first access; `load_shards` warms the ones a process
+    serves. The shard count is fixed when the store is created and kept in `shards.json`.
+    Leave history goes to a HistoryLog in `history/`; each shard records commits that add
+    history in its own CommitLog (`shard-NNNN.log`) before writing them.
+    """
+
+    def __init__(self, directory: str, num_shards: int | None = None, import_json_path: str | None = None,
+                 durability: str = DURABILITY_FILE):
+        super().__init__()
+        self.directory = directory
+        self.durability = validate_durability(durability)
+        meta_path = os.path.join(directory, "shards.json")
+
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                num_shards = json.load(file)["num_shards"]
+            self.shards = [_Shard(self._shard_path(i)) for i in range(num_shards)]
+        else:
+            # Seed a new store from an existing employees.json export
+            if not import_json_path:
+                raise FileNotFoundError(f"Employee data directory not found: {directory}")
+            try:
+                with open(import_json_path, 'r') as file:
+                    employees = json.load(file)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Employee data file not found: {import_json_path}")
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON format in file: {import_json_path}")
+
+            num_shards = num_shards or 16
+            os.makedirs(directory, exist_ok=True)
+            self.shards = [_Shard(self._shard_path(i)) for i in range(num_shards)]
+            for shard in self.shards:
+                shard.employees = {}
+            for name, balances in employees.items():
+                self.shard_for(name).employees[name] = balances
+            for shard in self.shards:
+                atomic_write_text(shard.path, json.dumps(shard.employees), self.durability)
+            atomic_write_text(meta_path, json.dumps({"num_shards": num_shards}), self.durability)
+
+        self.employees = _ShardedEmployees(self)
+        self.history_log = HistoryLog(os.path.join(directory, "history"), durability)
+        self.leave_history = LazyHistory(self.history_log, self.employees)
+
+        for shard in self.shards:
+            shard.commit_log = CommitLog(shard.path[:-len(".json")] + ".log", self.history_log, durability)
+            balances = shard.commit_log.replay()
+            if balances:
+                shard.load().update(balances)
+                atomic_write_text(shard.path, json.dumps(shard.employees), self.durability)
+            shard.commit_log.finish({})
+
+    def _shard_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"shard-{index:04d}.json")
+
+    def shard_index(self, employee_name: str) -> int:
+        """Return the index of the shard holding an employee."""
+        return int(employee_key(employee_name), 16) % len(self.shards)
+
+    def shard_for(self, employee_name: str) -> _Shard:
+        """Return the shard holding an employee."""
+        return self.shards[self.shard_index(employee_name)]
+
+    def load_shards(self, indexes: Iterable[int]):
+        """Read the given shards now rather than on first access."""
+        for index in indexes:
+            self.shards[index].load()
+
+    def lock_for(self, employee_name: str) -> threading.RLock:
+        return self.shard_for(employee_name).lock
+
+    def set_balance(self, employee_name: str, leave_type: str, balance: int | float):
+        shard = self.shard_for(employee_name)
+        with shard.lock:
+            shard.load()[employee_name][leave_type] = balance
+            shard.dirty = True
+
+    def add_leave(self, employee_name: str, record: dict):
+        shard = self.shard_for(employee_name)
+        with shard.lock:
+            super().add_leave(employee_name, record)
+            shard.pending_history.setdefault(employee_name, []).append(HistoryLog.leave_line(record))
+
+    def set_leave_status(self, employee_name: str, record: dict, status: str):
+        shard = self.shard_for(employee_name)
+        with shard.lock:
+            super().set_leave_status(employee_name, record, status)
+            index = next(i for i, leave in enumerate(self.leave_history[employee_name]) if leave is record)
+            shard.pending_history.setdefault(employee_name, []).append(HistoryLog.status_line(index, status))
+
+    def flush(self) -> bool:
+        # Shards are written one at a time under their own lock, so writers on other shards keep going
+        file_durability = DURABILITY_NONE if self.durability == DURABILITY_NONE else DURABILITY_FILE
+        written = False
+        for shard in self.shards:
+            if not (shard.dirty or shard.pending_history):
+                continue
+            with shard.lock:
+                try:
+                    if shard.pending_history:
+                        shard.commit_log.record(
+                            {name: shard.employees[name] for name in shard.pending_history}, shard.pending_history
+                        )
+                    if shard.dirty:
+                        atomic_write_text(shard.path, json.dumps(shard.employees), file_durability)
+                        shard.dirty = False
+                        written = True
+                        if shard.pending_history and self.durability == DURABILITY_DIRECTORY:
+                            # The rename must be durable before the record that could redo it is dropped
+                            fsync_directory(shard.path)
+                    shard.commit_log.finish(shard.pending_history)
+                except Exception as e:
+                    print(f"Error saving state: {str(e)}")
+                    return False
+
+        if written and self.durability == DURABILITY_DIRECTORY:
+            try:
+                fsync_directory(self.shards[0].path)
+            except Exception as e:
+                print(f"Error saving state: {str(e)}")
+                return False
+        return True
+
+
+class _SQLiteEmployees(Mapping):
+    """Read-only mapping view of employee balances stored in SQLite."""
+
+    def __init__(self, store: "SQLiteStore"):
+        self._store = store
+
+    def __getitem__(self, employee_name: str) -> dict:
+        rows = self._store.query(
+            "SELECT b.leave_type, b.days FROM balances b JOIN employees e ON e.id = b.employee_id "
+            "WHERE e.name = ? ORDER BY b.rowid",
+            (employee_name,)
+        )
+        if not rows and employee_name not in self:
+            raise KeyError(employee_name)
+        return dict(rows)
+
+    def __contains__(self, employee_name) -> bool:
+        return self._store.employee_id(employee_name) is not None
+
+    def __iter__(self):
+        for (name,) in self._store.query("SELECT name FROM employees ORDER BY id"):
+            yield name
+
+    def __len__(self) -> int:
+        return self._store.query("SELECT COUNT(*) FROM employees")[0][0]
+
+
+class _SQLiteHistory(Mapping):
+    """Read-only mapping view of leave records stored in SQLite."""
+
+    def __init__(self, store: "SQLiteStore"):
+        self._store = store
+
+    def __getitem__(self, employee_name: str) -> list[dict]:
+        employee_id = self._store.employee_id(employee_name)
+        if employee_id is None:
+            raise KeyError(employee_name)
+        return self._store.query_leaves("employee_id = ?", (employee_id,))
+
+    def __contains__(self, employee_name) -> bool:
+        return self._store.employee_id(employee_name) is not None
+
+    def __iter__(self):
+        return iter(self._store.employees)
+
+    def __len__(self) -> int:
+        return len(self._store.employees)
+
+
+class SQLiteStore(StorageBackend):
+    """
+    Stores employees, balances and leave records in a SQLite database running in WAL mode.
+
+    Lookups and mutations are indexed queries, so only the rows a call touches are read
+    and each commit is a single small transaction. Dates are stored as day ordinals.
+    The connection is shared between threads and only used while holding `lock`.
+    `durability` maps onto SQLite's synchronous setting.
+    """
+
+    SYNCHRONOUS = {
+        DURABILITY_NONE: "OFF",
+        DURABILITY_FILE: "FULL",
+        DURABILITY_DIRECTORY: "EXTRA"
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS balances (
+            employee_id INTEGER NOT NULL REFERENCES employees(id),
+            leave_type TEXT NOT NULL,
+            days NUMERIC NOT NULL,
+            PRIMARY KEY (employee_id, leave_type)
+        );
+        CREATE TABLE IF NOT EXISTS leaves (
+            id INTEGER PRIMARY KEY,
+            employee_id INTEGER NOT NULL REFERENCES employees(id),
+            type TEXT NOT NULL,
+            days NUMERIC NOT NULL,
+            start_ord INTEGER NOT NULL,
+            end_ord INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            request_ord INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_leaves_employee_start ON leaves (employee_id, start_ord);
+        CREATE INDEX IF NOT EXISTS idx_leaves_status_type ON leaves (status, type);
+    """
+
+    def __init__(self, db_path: str, import_json_path: str | None = None, durability: str = DURABILITY_FILE):
+        super().__init__()
+        self.db_path = db_path
+        self.durability = validate_durability(durability)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[durability]}")
+        self.conn.executescript(self.SCHEMA)
+
+        self.employees = _SQLiteEmployees(self)
+        self.leave_history = _SQLiteHistory(self)
+
+        # Seed an empty database from an existing employees.json export
+        if import_json_path and len(self.employees) == 0:
+            try:
+                with open(import_json_path, 'r') as file:
+                    self.import_employees(json.load(file))
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Employee data file not found: {import_json_path}")
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON format in file: {import_json_path}")
+
+    def import_employees(self, employees: Mapping):
+        """Insert or replace the balances of the given employees in one transaction."""
+        with self.lock, self.conn:
+            for name, balances in employees.items():
+                self.conn.execute("INSERT OR IGNORE INTO employees (name) VALUES (?)", (name,))
+                employee_id = self.employee_id(name)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO balances (employee_id, leave_type, days) VALUES (?, ?, ?)",
+                    [(employee_id, leave_type, days) for leave_type, days in balances.items()]
+                )
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Run a statement on the shared connection and return all result rows."""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def employee_id(self, employee_name: str) -> int | None:
+        """Return the row id of an employee, or None if the employee does not exist."""
+        rows = self.query("SELECT id FROM employees WHERE name = ?", (employee_name,))
+        return rows[0][0] if rows else None
+
+    def query_leaves(self, where: str, params: tuple) -> list[dict]:
+        """Return leave records matching a WHERE clause, oldest first."""
+        rows = self.query(
+            f"SELECT id, type, days, start_ord, end_ord, status, request_ord FROM leaves WHERE {where} ORDER BY id",
+            params
+        )
+        return [
+            {
+                "id": leave_id,
+                "type": leave_type,
+                "days": days,
+                "start": start,
+                "end": end,
+                "status": status,
+                "requested": requested
+            }
+            for leave_id, leave_type, days, start, end, status, requested in rows
+        ]
+
+    def set_balance(self, employee_name: str, leave_type: str, balance: int | float):
+        self.query(
+            "UPDATE balances SET days = ? WHERE employee_id = ? AND leave_type = ?",
+            (balance, self.employee_id(employee_name), leave_type)
+        )
+
+    def add_leave(self, employee_name: str, record: dict):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO leaves (employee_id, type, days, start_ord, end_ord, status, request_ord) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.employee_id(employee_name), record["type"], record["days"], record["start"],
+                 record["end"], record["status"], record["requested"])
+            )
+            record["id"] = cursor.lastrowid
+
+    def set_leave_status(self, employee_name: str, record: dict, status: str):
+        self.query("UPDATE leaves SET status = ? WHERE id = ?", (status, record["id"]))
+        record["status"] = status
+
+    def find_leaves(self, employee_name: str, status: str, leave_type: str | None = None,
+                    start: int | None = None) -> list[dict]:
+        where, params = "employee_id = ? AND status = ?", [self.employee_id(employee_name), status]
+        if leave_type is not None:
+            where += " AND type = ?"
+            params.append(leave_type)
+        if start is not None:
+            where += " AND start_ord = ?"
+            params.append(start)
+        return self.query_leaves(where, tuple(params))
+
+    def iter_approved_leaves(self) -> Iterable[tuple[str, int, int]]:
+        return self.query(
+            "SELECT e.name, l.start_ord, l.end_ord FROM leaves l JOIN employees e ON e.id = l.employee_id "
+            "WHERE l.status = 'approved'"
+        )
+
+    def has_overlap(self, employee_name: str, start: int, end: int) -> bool:
+        rows = self.query(
+            "SELECT 1 FROM leaves WHERE employee_id = ? AND start_ord <= ? AND end_ord >= ? "
+            "AND status = 'approved' LIMIT 1",
+            (self.employee_id(employee_name), end, start)
+        )
+        return bool(rows)
+
+    def flush(self) -> bool:
+        with self.lock:
+            try:
+                self.conn.commit()
+                return True
+            except sqlite3.Error as e:
+                print(f"Error saving state: {str(e)}")
+                self.conn.rollback()
+                return False
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class OverlapEngine(ABC):
+    """
+    Base class for answering "does this period overlap an approved leave?" per employee.
+
+    Periods are inclusive (start, end) day ordinals. The engine is told about every
+    approved and cancelled leave so it can keep its own structures up to date; callers
+    hold the employee's store lock around checks and updates.
+    """
+
+    def __init__(self, store: StorageBackend):
+        self.store = store
+
+    @abstractmethod
+    def has_overlap(self, employee_name: str, start_ordinal: int, end_ordinal: int) -> bool:
+        """Return whether the inclusive period overlaps one of the employee's approved leaves."""
+
+    def add(self, employee_name: str, start_ordinal: int, end_ordinal: int):
+        """Record a newly approved leave."""
+
+    def remove(self, employee_name: str, start_ordinal: int, end_ordinal: int):
+        """Forget a cancelled leave."""
+
+
+class StoreOverlapEngine(OverlapEngine):
+    """Delegates to the storage backend: a history scan, or an indexed query for SQLite."""
+
+    def has_overlap(self, employee_name: str, start_ordinal: int, end_ordinal: int) -> bool:
+        return self.store.has_overlap(employee_name, start_ordinal, end_ordinal)
+
+
+class IntervalIndex:
+    """
+    Sorted, non-overlapping leave periods of one employee.
+
+    Starts and ends are kept in parallel sorted lists. Because approved leaves never
+    overlap, the only candidate for a conflict is the last period starting on or before
+    the new period's end, so checks, inserts and removals are bisect operations.
+    """
+
+    def __init__(self, periods: Iterable[tuple[int, int]] = ()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(periods):
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        index = bisect.bisect_right(self.starts, end) - 1
+        return index >= 0 and self.ends[index] >= start
+
+    def add(self, start: int, end: int):
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+
+    def remove(self, start: int, end: int):
+        index = bisect.bisect_left(self.starts, start)
+        while index < len(self.starts) and self.starts[index] == start:
+            if self.ends[index] == end:
+                del self.starts[index]
+                del self.ends[index]
+                return
+            index += 1
+
+
+class IntervalOverlapEngine(OverlapEngine):
+    """Keeps an IntervalIndex per employee, built from their approved leaves on first use."""
+
+    def __init__(self, store: StorageBackend):
+        super().__init__(store)
+        self._indexes = {}
+
+    def index_for(self, employee_name: str) -> IntervalIndex:
+        index = self._indexes.get(employee_name)
+        if index is None:
+            periods = [(leave["start"], leave["end"]) for leave in self.store.find_leaves(employee_name, "approved")]
+            index = self._indexes[employee_name] = IntervalIndex(periods)
+        return index
+
+    def has_overlap(self, employee_name: str, start_ordinal: int, end_ordinal: int) -> bool:
+        return self.index_for(employee_name).overlaps(start_ordinal, end_ordinal)
+
+    def add(self, employee_name: str, start_ordinal: int, end_ordinal: int):
+        self.index_for(employee_name).add(start_ordinal, end_ordinal)
+
+    def remove(self, employee_name: str, start_ordinal: int, end_ordinal: int):
+        self.index_for(employee_name).remove(start_ordinal, end_ordinal)
+
+
+class BitmapOverlapEngine(OverlapEngine):
+    """
+    Keeps one bit per booked day per employee over a rolling horizon around today.
+
+    Each employee's bitmap is a Python int covering `horizon_days` either side of the
+    anchor day. A check inside the horizon is a single masked AND; approving or
+    cancelling sets or clears a bit range. Checks reaching outside the horizon fall
+    back to the store. Once today is more than `reanchor_days` past the anchor, the
+    horizon is moved to centre on today and bitmaps are rebuilt on next use.
+
+    Callers on different shards of a ShardedJsonStore hold different locks, so the engine
+    has its own lock around re-anchoring and every read-modify-write of a bitmap; a bitmap
+    built for one origin can then never be stored after the horizon moved.
+    """
+
+    def __init__(self, store: StorageBackend, horizon_days: int = 3 * 365, reanchor_days: int = 30):
+        super().__init__(store)
+        self.horizon_days = horizon_days
+        self.reanchor_days = reanchor_days
+        self._lock = threading.Lock()
+        self._anchor(date.today().toordinal())
+
+    def _anchor(self, today: int):
+        """Centre the horizon on `today` and drop the bitmaps built for the old one."""
+        self.anchor = today
+        self.origin = today - self.horizon_days
+        self.limit = today + self.horizon_days
+        self._bitmaps = {}
+        self._reanchor_at = datetime.fromordinal(today + self.reanchor_days + 1).timestamp()
+
+    def _roll(self):
+        # A clock comparison per call; the date is only looked up once re-anchoring is due
+        if time.time() >= self._reanchor_at:
+            self._anchor(date.today().toordinal())
+
+    def _mask(self, start: int, end: int) -> int:
+        """Return the bits for the part of the inclusive range inside the horizon."""
+        start, end = max(start, self.origin), min(end, self.limit)
+        if start > end:
+            return 0
+        return ((1 << (end - start + 1)) - 1) << (start - self.origin)
+
+    def bitmap_for(self, employee_name: str) -> int:
+        with self._lock:
+            return self._bitmap(employee_name)
+
+    def _bitmap(self, employee_name: str) -> int:
+        """Return an employee's bitmap, building it from the store; the caller holds the engine lock."""
+        bitmap = self._bitmaps.get(employee_name)
+        if bitmap is None:
+            bitmap = 0
+            for leave in self.store.find_leaves(employee_name, "approved"):
+                bitmap |= self._mask(leave["start"], leave["end"])
+            self._bitmaps[employee_name] = bitmap
+        return bitmap
+
+    def has_overlap(self, employee_name: str, start_ordinal: int, end_ordinal: int) -> bool:
+        with self._lock:
+            self._roll()
+            if self.origin <= start_ordinal and end_ordinal <= self.limit:
+                return self._bitmap(employee_name) & self._mask(start_ordinal, end_ordinal) != 0
+        return self.store.has_overlap(employee_name, start_ordinal, end_ordinal)
+
+    def add(self, employee_name: str, start_ordinal: int, end_ordinal: int):
+        with self._lock:
+            self._roll()
+            self._bitmaps[employee_name] = self._bitmap(employee_name) | self._mask(start_ordinal, end_ordinal)
+
+    def remove(self, employee_name: str, start_ordinal: int, end_ordinal: int):
+        # Approved leaves never overlap, so clearing this range cannot touch another leave's days
+        with self._lock:
+            self._roll()
+            self._bitmaps[employee_name] = self._bitmap(employee_name) & ~self._mask(start_ordinal, end_ordinal)
+
+
+OVERLAP_ENGINES = {
+    "scan": StoreOverlapEngine,
+    "interval": IntervalOverlapEngine,
+    "bitmap": BitmapOverlapEngine
+}
+
+
+class LeaveCalendar:
+    """
+    Org-wide index from day ordinals to the employees on approved leave that day.
+
+    The index is built from the store on the first query and then kept up to date by
+    `add` and `remove` as leaves are approved and cancelled, so "who is off" queries
+    are dictionary lookups rather than scans over every employee's history.
+    """
+
+    def __init__(self, store: StorageBackend):
+        self.store = store
+        self._days = {}
+        self._built = False
+        self._lock = threading.Lock()
+
+    def _build(self):
+        for employee_name, start, end in self.store.iter_approved_leaves():
+            self._add(employee_name, start, end)
+        self._built = True
+
+    def _add(self, employee_name: str, start: int, end: int):
+        for day in range(start, end + 1):
+            self._days.setdefault(day, set()).add(employee_name)
+
+    def add(self, employee_name: str, start: int, end: int):
+        """Record an approved leave covering the inclusive day range."""
+        with self._lock:
+            # Before the first query the store is the source of truth; the build will pick it up
+            if self._built:
+                self._add(employee_name, start, end)
+
+    def remove(self, employee_name: str, start: int, end: int):
+        """Remove a cancelled leave covering the inclusive day range."""
+        with self._lock:
+            if not self._built:
+                return
+            for day in range(start, end + 1):
+                names = self._days.get(day)
+                if names is not None:
+                    names.discard(employee_name)
+                    if not names:
+                        del self._days[day]
+
+    def on_leave(self, start: int, end: int | None = None) -> set[str]:
+        """Return the employees on approved leave on any day of the inclusive range."""
+        with self._lock:
+            if not self._built:
+                self._build()
+            if end is None or end == start:
+                return set(self._days.get(start, ()))
+            names = set()
+            for day in range(start, end + 1):
+                names.update(self._days.get(day, ()))
+            return names
+
+
+# Words that map onto each standard leave type, as listed in the LLM system prompt
+LEAVE_TYPE_SYNONYMS = {
+    "Sick Leave": ("sick", "medical", "health", "doctor", "ill", "illness"),
+    "Annual Leave": ("annual", "vacation", "holiday", "holidays", "personal", "time off", "pto"),
+    "Maternity Leave": ("maternity", "pregnancy", "parental")
+}
+
+
+class RuleIntentParser:
+    """
+    Recognize the common query patterns locally with keyword and regex grammars.
+
+    `parse` returns the same intent dicts as the LLM together with a confidence:
+    1.0 when exactly one intent matched with every field it needs, lower when the
+    query is ambiguous or incomplete and should go to the LLM instead. Requests need
+    an explicit request verb, and questions about a request or cancellation ("did my
+    leave from ... get approved?") are never taken as the action itself.
+    """
+
+    DATE_PATTERN = re.compile(r"\btoday\b|\b\d{4}[-.]\d{1,2}[-.]\d{1,2}\b|\b\d{1,2}[-.]\d{1,2}[-.]\d{4}\b")
+    DAYS_PATTERN = re.compile(r"\b(\d+)\s*-?\s*(?:working\s+)?days?\b")
+    # delete/remove/drop only cancel when their object is a leave ("drop my sick leave", not "drop off my kid")
+    CANCEL_PATTERN = re.compile(
+        r"\b(?:cancel|withdraw|revoke)\b"
+        r"|\b(?:delete|remove|drop)\s+(?:[\w']+\s+){0,3}?(?:leaves?|days?|vacation|holiday|booking)\b"
+    )
+    HISTORY_PATTERN = re.compile(r"\b(?:history|past leaves|previous leaves)\b")
+    BALANCE_PATTERN = re.compile(r"\b(?:balances?|left|remaining|how many|how much|available|show|check)\b")
+    # Negations and conditionals change the meaning in ways keywords cannot follow
+    HEDGE_PATTERN = re.compile(r"\b(?:not|don't|dont|never|instead|unless|and then)\b")
+    COMPOUND_PATTERN = re.compile(r"\b(?:and|then|also|plus)\b|[,;]")
+    REQUEST_PATTERN = re.compile(r"\b(?:book|request|apply|take|schedule|need|want)\b")
+    QUESTION_PATTERN = re.compile(r"\?|\b(?:whether|did)\b")
+    INTENT_KEYWORDS = (
+        ("cancel_leave", CANCEL_PATTERN),
+        ("view_history", HISTORY_PATTERN),
+        ("request_leave", REQUEST_PATTERN),
+        ("check_balance", BALANCE_PATTERN)
+    )
+
+    def __init__(self, synonyms: Mapping[str, Iterable[str]] = LEAVE_TYPE_SYNONYMS):
+        self._type_patterns = [
+            (leave_type, re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b"))
+            for leave_type, words in synonyms.items()
+        ]
+
+    def leave_types(self, text: str) -> list[str]:
+        """Return the standard leave types mentioned in lowercased `text`, in canonical order."""
+        return [leave_type for leave_type, pattern in self._type_patterns if pattern.search(text)]
+
+    def _candidate_intents(self, text: str) -> set[str]:
+        candidates = {intent for intent, pattern in self.INTENT_KEYWORDS if pattern.search(text)}
+        if self.DAYS_PATTERN.search(self.DATE_PATTERN.sub(" ", text)):
+            candidates.add("request_leave")
+        return candidates
+
+    def likely_intents(self, user_input: str) -> set[str] | None:
+        """Return the one or two intents a query most likely expresses, or None when unsure."""
+        candidates = self._candidate_intents(" ".join(user_input.lower().split()))
+        return candidates if 0 < len(candidates) <= 2 else None
+
+    def parse(self, user_input: str) -> tuple[dict | None, float]:
+        """Return (intent dict or None, confidence) for a user query."""
+        text = " ".join(user_input.lower().split())
+        if not text or self.HEDGE_PATTERN.search(text):
+            return None, 0.0
+        # Compound queries ("book ... and show my balance") go to the LLM, which returns every intent
+        if self.COMPOUND_PATTERN.search(text) and len(self._candidate_intents(text)) > 1:
+            return None, 0.5
+
+        dates = self.DATE_PATTERN.findall(text)
+        # Date digits must not be read as day counts
+        days = self.DAYS_PATTERN.findall(self.DATE_PATTERN.sub(" ", text))
+        leave_types = self.leave_types(text)
+
+        intents = []
+        if self.CANCEL_PATTERN.search(text):
+            intents.append("cancel_leave")
+        if self.HISTORY_PATTERN.search(text):
+            intents.append("view_history")
+        if days and "cancel_leave" not in intents:
+            intents.append("request_leave")
+        if not intents and self.BALANCE_PATTERN.search(text):
+            intents.append("check_balance")
+        if len(intents) != 1:
+            return None, 0.0
+        intent = intents[0]
+        # "need 1 day ... to drop off ..." or "cancel ... and take ..." mixes both actions
+        if intent == "cancel_leave" and self.REQUEST_PATTERN.search(text):
+            return None, 0.5
+
+        if intent == "view_history":
+            return {"intent": "view_history"}, 1.0 if not dates and not leave_types else 0.5
+
+        if intent == "check_balance":
+            if dates:
+                return None, 0.5
+            if not leave_types:
+                return {"intent": "check_balance", "leave_type": "all"}, 1.0
+            if len(leave_types) == 1:
+                return {"intent": "check_balance", "leave_type": leave_types[0]}, 1.0
+            return {"intent": "check_balance", "leave_type": leave_types}, 1.0
+
+        # Requests and cancellations need exactly one leave type and one start date,
+        # and a question about one is not the action itself
+        if len(leave_types) != 1 or len(dates) != 1 or self.QUESTION_PATTERN.search(text):
+            return None, 0.5
+        if intent == "cancel_leave":
+            return {"intent": "cancel_leave", "leave_type": leave_types[0], "start_date": dates[0]}, 1.0
+        # A day count alone ("2 days annual leave from ...") does not say what to do with it
+        if len(days) != 1 or int(days[0]) <= 0 or not self.REQUEST_PATTERN.search(text):
+            return None, 0.5
+        return {
+            "intent": "request_leave",
+            "leave_type": leave_types[0],
+            "days": int(days[0]),
+            "start_date": dates[0]
+        }, 1.0
+
+
+JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "null": (type(None),),
+    "object": (dict,),
+    "array": (list,)
+}
+
+
+def compile_validator(schema: Mapping, path: str = "$") -> Callable[[object], str | None]:
+    """
+    Compile the JSON Schema subset used for structured outputs (type, enum, anyOf, properties,
+    required, additionalProperties, items) into a function returning an error message or None.
+    """
+    checks = []
+
+    if "type" in schema:
+        names = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        types = tuple(t for name in names for t in JSON_TYPES[name])
+        # bool is an int subclass but never a JSON number
+        allow_bool = "boolean" in names
+
+        def check_type(value):
+            if not isinstance(value, types) or (isinstance(value, bool) and not allow_bool):
+                return f"{path}: expected {' or '.join(names)}"
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value):
+            if value not in allowed:
+                return f"{path}: {value!r} is not one of {allowed}"
+        checks.append(check_enum)
+
+    if "anyOf" in schema:
+        options = [compile_validator(option, path) for option in schema["anyOf"]]
+
+        def check_any_of(value):
+            errors = [option(value) for option in options]
+            if all(errors):
+                return "; ".join(errors)
+        checks.append(check_any_of)
+
+    if "properties" in schema:
+        properties = {key: compile_validator(sub, f"{path}.{key}") for key, sub in schema["properties"].items()}
+        required = list(schema.get("required", ()))
+        closed = schema.get("additionalProperties") is False
+
+        def check_properties(value):
+            if not isinstance(value, dict):
+                return None
+            for key in required:
+                if key not in value:
+                    return f"{path}: missing {key}"
+            for key, item in value.items():
+                if key in properties:
+                    error = properties[key](item)
+                    if error:
+                        return error
+                elif closed:
+                    return f"{path}: unexpected {key}"
+        checks.append(check_properties)
+
+    if "items" in schema:
+        item_validator = compile_validator(schema["items"], f"{path}[]")
+
+        def check_items(value):
+            if isinstance(value, list):
+                for item in value:
+                    error = item_validator(item)
+                    if error:
+                        return error
+        checks.append(check_items)
+
+    def validate(value) -> str | None:
+        for check in checks:
+            error = check(value)
+            if error:
+                return error
+        return None
+
+    return validate
+
+
+class PromptTemplate:
+    """
+    A versioned intent-extraction prompt.
+
+    The system message is identical for every call, so provider prompt caching can reuse
+    it; everything that varies per employee or query goes in the final user message.
+    Indentation and blank lines are stripped since they cost tokens and carry no meaning.
+
+    Templates may split their instructions and examples into per-intent `sections`.
+    Asking for a subset of intents then sends the shared header and only those sections;
+    asking for None sends everything.
+    """
+
+    def __init__(self, version: str, system: str, user: str = "Employee: {employee_name}\nQuery: {user_input}",
+                 sections: Mapping[str, str] | None = None):
+        self.version = version
+        self.header = self._strip(system)
+        self.sections = {intent: self._strip(text) for intent, text in (sections or {}).items()}
+        self.system = "\n".join([self.header, *self.sections.values()])
+        self.user = user
+        self._systems = {}
+
+    @staticmethod
+    def _strip(text: str) -> str:
+        return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+    def system_for(self, intents: Iterable[str] | None = None) -> str:
+        """Return the system message covering `intents`, or every intent if None or unknown."""
+        if intents is None or not self.sections or not set(intents) <= self.sections.keys():
+            return self.system
+        # Keep section order fixed so each subset always yields the same cacheable prefix
+        selected = tuple(intent for intent in self.sections if intent in intents)
+        system = self._systems.get(selected)
+        if system is None:
+            system = self._systems[selected] = "\n".join([self.header, *(self.sections[i] for i in selected)])
+        return system
+
+    def messages(self, user_input: str, employee_name: str, intents: Iterable[str] | None = None) -> list[dict]:
+        """Return the chat messages for one query, limited to the sections of `intents` when given."""
+        return [
+            {"role": "system", "content": self.system_for(intents)},
+            {"role": "user", "content": self.user.format(employee_name=employee_name, user_input=user_input)}
+        ]
+
+
+# Per-intent instructions and examples; a pre-classified query only carries the ones it needs
+INTENT_PROMPT_SECTIONS = {
+    "check_balance": """
+    check_balance: leave_type is "all", one type, or a list of types
+    "How many sick days left?" -> check_balance, Sick Leave
+    "Show my sick and annual leave" -> check_balance, [Sick Leave, Annual Leave]
+    """,
+    "request_leave": """
+    request_leave: leave_type, days (positive integer), start_date
+    start_date: "today" or the date as written (YYYY-MM-DD, YYYY.MM.DD, DD-MM-YYYY or DD.MM.YYYY)
+    "Book annual leave for 2 days from 15.01.2024" -> request_leave, Annual Leave, 2, 15.01.2024
+    """,
+    "cancel_leave": """
+    cancel_leave: leave_type, start_date ("today" or the date as written)
+    "Cancel my sick leave for today" -> cancel_leave, Sick Leave, today
+    """,
+    "view_history": """
+    view_history: no fields
+    """
+}
+
+# Versions v1-v3 asked for a single intent object and were retired with the list-valued
+# QUERY_SCHEMA; version numbers are never reused, since they key the intent cache.
+PROMPT_TEMPLATES = {template.version: template for template in (
+    PromptTemplate("v4", """
+    Extract the intents of a leave management query, one entry per request, in the order given.
+    Leave types and synonyms:
+    Sick Leave: sick, medical, health, doctor
+    Annual Leave: annual, vacation, holiday, personal, time off
+    Maternity Leave: maternity, pregnancy, parental
+    Intents: check_balance, request_leave, cancel_leave, view_history, unknown (anything else).
+    Fields an intent does not use are null.
+    "Cancel annual leave on 15.01.2024 and book 3 days sick leave from today" -> cancel_leave, then request_leave
+    """, sections=INTENT_PROMPT_SECTIONS),
+)}
+
+
+class LLMStats:
+    """Thread-safe counters describing LLM calls, their token usage and how their answers parsed."""
+
+    def __init__(self):
+        self._counts = {
+            "responses": 0, "json_errors": 0, "schema_errors": 0, "refusals": 0,
+            "full_prompts": 0, "selected_prompts": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0
+        }
+        self._lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1):
+        """Add `amount` to the named counter."""
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def record_usage(self, usage):
+        """Add the token counts of one completion, given as an SDK usage object or its JSON dict."""
+        if usage is None:
+            return
+
+        def field(obj, name):
+            value = obj.get(name) if isinstance(obj, Mapping) else getattr(obj, name, None)
+            return value or 0
+
+        details = field(usage, "prompt_tokens_details")
+        with self._lock:
+            self._counts["prompt_tokens"] += field(usage, "prompt_tokens")
+            self._counts["completion_tokens"] += field(usage, "completion_tokens")
+            self._counts["cached_tokens"] += field(details, "cached_tokens") if details else 0
+
+    def snapshot(self) -> dict:
+        """Return a copy of every counter."""
+        with self._lock:
+            return dict(self._counts)
+
+
+class IntentCache:
+    """
+    LRU cache with a time-to-live for intents returned by the LLM, persisted as JSON.
+
+    Keys are normalized queries: case, whitespace and punctuation are folded (separators
+    inside dates are kept) and the employee's name is removed, so rephrasings that differ
+    only in those respects share an entry. Queries with relative dates such as "today"
+    are keyed on the current day as well, so a cached answer never crosses midnight.
+    """
+
+    RELATIVE_DATE_PATTERN = re.compile(r"\b(?:today|tonight|tomorrow|yesterday|now|this|next|last|coming)\b")
+    PUNCTUATION_PATTERN = re.compile(r"(?<!\d)[^\w\s]|[^\w\s](?!\d)")
+
+    def __init__(self, path: str | None = None, max_entries: int = 1024, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            # A damaged cache is only a lost optimization
+            return
+        now = time.time()
+        for key, expires_at, intents in entries[-self.max_entries:]:
+            if expires_at > now:
+                self._entries[key] = (expires_at, intents)
+
+    def save(self):
+        """Write the live entries to disk, least recently used first."""
+        if self.path is None:
+            return
+        with self._lock:
+            entries = [[key, expires_at, intents] for key, (expires_at, intents) in self._entries.items()]
+        atomic_write_text(self.path, json.dumps(entries), DURABILITY_NONE)
+
+    def key(self, user_input: str, employee_name: str, today: int) -> str:
+        """Return the cache key of a query made by `employee_name` on day ordinal `today`."""
+        text = user_input.lower()
+        if employee_name:
+            text = re.sub(r"\b" + re.escape(employee_name.lower()) + r"\b", " ", text)
+        text = " ".join(self.PUNCTUATION_PATTERN.sub(" ", text).split())
+        if self.RELATIVE_DATE_PATTERN.search(text):
+            return f"{today}|{text}"
+        return text
+
+    def get(self, key: str) -> list[dict] | None:
+        """Return a copy of the cached intents for `key`, counting the hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(json.dumps(entry[1]))
+
+    def put(self, key: str, intents: list[dict], save: bool = True):
+        """Cache `intents` under `key`, evicting the least recently used entry when full; persist if `save`."""
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, json.loads(json.dumps(intents)))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if save:
+            self.save()
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class NLUBackend(ABC):
+    """
+    Base class for turning a query into the intents `process_natural_language` returns.
+
+    Backends see only queries the local rule parser could not read with confidence.
+    `cacheable` backends have their answers kept in the intent cache.
+    """
+
+    cacheable = False
+
+    def __init__(self, lms: "LeaveManagementSystem"):
+        self.lms = lms
+
+    @abstractmethod
+    def parse(self, user_input: str, employee_name: str) -> list[dict]:
+        """Return the intents of a query, or a single error or unknown intent."""
+
+
+class OpenAIBackend(NLUBackend):
+    """Asks the OpenAI chat model, with the system's prompt template and response schema."""
+
+    cacheable = True
+
+    def __init__(self, lms: "LeaveManagementSystem"):
+        super().__init__(lms)
+        if lms.client is None:
+            raise ValueError("OPENAI_API_KEY environment variable is not set!")
+
+    def parse(self, user_input: str, employee_name: str) -> list[dict]:
+        try:
+            response = self.lms.client.chat.completions.create(**self.lms._llm_request(user_input, employee_name))
+            self.lms.llm_stats.record_usage(getattr(response, "usage", None))
+            message = response.choices[0].message
+            return self.lms._parse_llm_response(message.content, getattr(message, "refusal", None))
+
+        except Exception as e:
+            return [{"intent": "error", "message": f"Error processing request: {str(e)}"}]
+
+
+class BagOfWordsClassifier:
+    """
+    Multinomial naive Bayes over word unigrams and bigrams.
+
+    Naive Bayes is linear in the bag-of-words counts, so prediction is one dictionary
+    lookup and a short vector add per feature. Digits are not features: dates and day
+    counts are slots, extracted separately.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.labels = []
+        self._priors = []
+        self._weights = {}
+
+    @classmethod
+    def features(cls, text: str) -> list[str]:
+        """Return the unigram and bigram features of `text`."""
+        words = cls.TOKEN_PATTERN.findall(text.lower())
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str]) -> "BagOfWordsClassifier":
+        """Train on parallel sequences of texts and labels. Returns self."""
+        if not texts:
+            raise ValueError("Cannot train a classifier without examples")
+        self.labels = sorted(set(labels))
+        index = {label: i for i, label in enumerate(self.labels)}
+        documents = [0] * len(self.labels)
+        totals = [0] * len(self.labels)
+        counts = {}
+        for text, label in zip(texts, labels):
+            i = index[label]
+            documents[i] += 1
+            for feature in self.features(text):
+                counts.setdefault(feature, [0] * len(self.labels))[i] += 1
+                totals[i] += 1
+
+        vocabulary = len(counts)
+        self._priors = [math.log(n / len(texts)) for n in documents]
+        self._weights = {
+            feature: [math.log((count + self.alpha) / (totals[i] + self.alpha * vocabulary))
+                      for i, count in enumerate(feature_counts)]
+            for feature, feature_counts in counts.items()
+        }
+        return self
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """Return (most likely label, its probability)."""
+        scores = list(self._priors)
+        for feature in self.features(text):
+            weights = self._weights.get(feature)
+            if weights is not None:
+                scores = [score + weight for score, weight in zip(scores, weights)]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        total = sum(math.exp(score - scores[best]) for score in scores)
+        return self.labels[best], 1.0 / total
+
+
+# Training examples for the offline backend: (query, intent, leave type or None)
+DEFAULT_NLU_EXAMPLES = (
+    ("show all my leave balances", "check_balance", "all"),
+    ("how many leaves do I have", "check_balance", "all"),
+    ("what is my balance", "check_balance", "all"),
+    ("how many days off do I have left", "check_balance", "all"),
+    ("how many sick days left", "check_balance", "Sick Leave"),
+    ("what's my remaining vacation", "check_balance", "Annual Leave"),
+    ("how much annual leave is available", "check_balance", "Annual Leave"),
+    ("check my maternity balance", "check_balance", "Maternity Leave"),
+    ("show my sick and annual leave", "check_balance", None),
+    ("I want 3 days sick leave starting today", "request_leave", "Sick Leave"),
+    ("book annual leave for 2 days from 15.01.2024", "request_leave", "Annual Leave"),
+    ("please request 5 days vacation from 2024-07-01", "request_leave", "Annual Leave"),
+    ("I am ill and need 2 days off from today", "request_leave", "Sick Leave"),
+    ("feeling unwell, please put me down for a day from today", "request_leave", "Sick Leave"),
+    ("can I take 4 days holiday starting 01.08.2024", "request_leave", "Annual Leave"),
+    ("apply for 90 days maternity leave from 2024-09-01", "request_leave", "Maternity Leave"),
+    ("doctor appointment, 1 day medical leave on 2024-03-05", "request_leave", "Sick Leave"),
+    ("schedule time off for 3 days beginning 10.10.2024", "request_leave", "Annual Leave"),
+    ("put me down for a couple of days of personal time from today", "request_leave", "Annual Leave"),
+    ("cancel my sick leave for today", "cancel_leave", "Sick Leave"),
+    ("cancel annual leave starting 15.01.2024", "cancel_leave", "Annual Leave"),
+    ("withdraw my vacation request from 2024-07-01", "cancel_leave", "Annual Leave"),
+    ("I no longer need the medical leave on 05.03.2024", "cancel_leave", "Sick Leave"),
+    ("please revoke my maternity leave starting 2024-09-01", "cancel_leave", "Maternity Leave"),
+    ("drop the holiday I booked for 01.08.2024", "cancel_leave", "Annual Leave"),
+    ("view history", "view_history", None),
+    ("show my leave history", "view_history", None),
+    ("what leaves have I taken", "view_history", None),
+    ("list my past leaves", "view_history", None),
+    ("show previous leave requests", "view_history", None),
+    ("hello", "unknown", None),
+    ("what is the weather like", "unknown", None),
+    ("who are you", "unknown", None),
+    ("tell me a joke", "unknown", None),
+    ("thanks", "unknown", None)
+)
+
+
+class LocalNLUBackend(NLUBackend):
+    """
+    Offline backend: bag-of-words classifiers for the intent and the leave type, plus
+    pattern-based extraction of day counts and dates. Needs no network or API key.
+
+    Trains on DEFAULT_NLU_EXAMPLES, or on a JSONL file whose lines look like
+    {"text": "...", "intent": "request_leave", "leave_type": "Annual Leave"}
+    (leave_type may be null or missing).
+
+    Word counts cannot follow negations, questions or several requests in one query,
+    so those are answered with a request to rephrase instead of being acted on, and a
+    request or cancellation only uses a leave type its query names explicitly.
+    """
+
+    REPHRASE_MESSAGE = ("I can't act on that safely without the online assistant. "
+                        "Please ask for one thing at a time, as a direct request.")
+
+    NUMBER_WORDS = {
+        "a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+        "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "a couple of": 2
+    }
+    WORD_DAYS_PATTERN = re.compile(
+        r"\b(a couple of|a|one|two|three|four|five|six|seven|eight|nine|ten)\s+(?:working\s+)?days?\b"
+    )
+
+    def __init__(self, lms: "LeaveManagementSystem", training_path: str | None = None, min_confidence: float = 0.5):
+        super().__init__(lms)
+        self.min_confidence = min_confidence
+        if training_path is None:
+            self.fit(DEFAULT_NLU_EXAMPLES)
+        else:
+            self.train(training_path)
+
+    def train(self, training_path: str):
+        """Retrain both classifiers from a labelled JSONL file."""
+        examples = []
+        with open(training_path, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    example = json.loads(line)
+                    examples.append((example["text"], example["intent"], example.get("leave_type")))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    raise ValueError(f"Line {line_number} of {training_path} is not a labelled example")
+        self.fit(examples)
+
+    def fit(self, examples: Iterable[tuple[str, str, str | None]]):
+        """Train both classifiers from (text, intent, leave type or None) triples."""
+        examples = list(examples)
+        self.intent_model = BagOfWordsClassifier().fit(
+            [text for text, _, _ in examples], [intent for _, intent, _ in examples]
+        )
+        typed = [(text, leave_type) for text, _, leave_type in examples if leave_type]
+        self.type_model = BagOfWordsClassifier().fit([text for text, _ in typed], [label for _, label in typed])
+
+    def _days(self, text: str) -> int | None:
+        parser = self.lms.intent_parser
+        days = parser.DAYS_PATTERN.findall(parser.DATE_PATTERN.sub(" ", text))
+        if days:
+            return int(days[0])
+        words = self.WORD_DAYS_PATTERN.search(text)
+        return self.NUMBER_WORDS[words.group(1)] if words else None
+
+    def parse(self, user_input: str, employee_name: str) -> list[dict]:
+        text = " ".join(user_input.lower().split())
+        rules = self.lms.intent_parser
+        # One merged intent would drop part of a compound query, so never guess at one
+        if rules.COMPOUND_PATTERN.search(text) and len(rules._candidate_intents(text)) > 1:
+            return [{"intent": "error", "message": self.REPHRASE_MESSAGE}]
+        intent, confidence = self.intent_model.predict(text)
+        if intent == "unknown" or confidence < self.min_confidence:
+            return [{"intent": "unknown"}]
+        if intent == "view_history":
+            return [{"intent": "view_history"}]
+
+        # Synonym keywords are exact; the classifier covers phrasings they miss
+        leave_types = rules.leave_types(text)
+        if intent == "check_balance":
+            if len(leave_types) > 1:
+                return [{"intent": "check_balance", "leave_type": leave_types}]
+            predicted_type = leave_types[0] if leave_types else self.type_model.predict(text)[0]
+            return [{"intent": "check_balance", "leave_type": predicted_type}]
+
+        # Negated or questioning requests ("I don't want ...", "did ... get approved?") must not change anything
+        if rules.HEDGE_PATTERN.search(text) or rules.QUESTION_PATTERN.search(text):
+            return [{"intent": "error", "message": self.REPHRASE_MESSAGE}]
+
+        parsed = {"intent": intent}
+        if len(leave_types) == 1:
+            parsed["leave_type"] = leave_types[0]
+        dates = self.lms.intent_parser.DATE_PATTERN.findall(text)
+        if dates:
+            parsed["start_date"] = dates[0]
+        if intent == "request_leave":
+            days = self._days(text)
+            if days is not None:
+                parsed["days"] = days
+        return [self.lms._check_intent(parsed)]
+
+
+NLU_BACKENDS = {
+    "openai": OpenAIBackend,
+    "local": LocalNLUBackend
+}
+
+
 class LeaveManagementSystem:
     # Core leave types
     LEAVE_TYPES = [
@@ -16,190 +2667,384 @@ class LeaveManagementSystem:
         "Maternity Leave"
     ]
 
-    def __init__(self, json_file_path: str):
-        # Fetch API key from environment variable
+    # Chat model used to extract intents from queries the local parser cannot read
+    LLM_MODEL = "gpt-4o-mini"
+
+    # Prompt template version sent to the LLM (see PROMPT_TEMPLATES)
+    PROMPT_VERSION = "v4"
+
+    # Queries the local parser recognizes with at least this confidence skip the LLM
+    LOCAL_INTENT_CONFIDENCE = 0.9
+
+    # Strict structured-output schema for one intent of the LLM's answer. Absent fields come back as null.
+    INTENT_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "intent": {
+                "type": "string",
+                "enum": ["check_balance", "request_leave", "cancel_leave", "view_history", "unknown"]
+            },
+            "leave_type": {
+                "anyOf": [
+                    {"type": "string", "enum": LEAVE_TYPES + ["all"]},
+                    {"type": "array", "items": {"type": "string", "enum": LEAVE_TYPES}},
+                    {"type": "null"}
+                ]
+            },
+            "days": {"type": ["integer", "null"]},
+            "start_date": {"type": ["string", "null"]}
+        },
+        "required": ["intent", "leave_type", "days", "start_date"],
+        "additionalProperties": False
+    }
+
+    # A query may hold several intents; strict mode needs an object at the root
+    QUERY_SCHEMA = {
+        "type": "object",
+        "properties": {"intents": {"type": "array", "items": INTENT_SCHEMA}},
+        "required": ["intents"],
+        "additionalProperties": False
+    }
+
+    RESPONSE_FORMAT = {
+        "type": "json_schema",
+        "json_schema": {"name": "leave_intents", "strict": True, "schema": QUERY_SCHEMA}
+    }
+
+    INVALID_DATE_MESSAGE = "Invalid date format. Please use YYYY-MM-DD, YYYY.MM.DD, DD-MM-YYYY, DD.MM.YYYY or 'today'"
+    SAVE_ERROR_MESSAGE = "Error saving state: the change could not be saved. Please try again later."
+    # Fields each intent needs before it can be carried out
+    INTENT_FIELDS = {
+        "check_balance": ("leave_type",),
+        "request_leave": ("leave_type", "days", "start_date"),
+        "cancel_leave": ("leave_type", "start_date"),
+        "view_history": ()
+    }
+
+    def __init__(self, json_file_path: str, journal: bool = False, compact_threshold: int = 1000,
+                 store: StorageBackend | None = None, overlap_engine: str = "interval",
+                 intent_cache: IntentCache | None = None, nlu_backend: str | None = None):
+        # Fetch API key from environment variable; without one only offline understanding is available
         api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set!")
-        self.client = OpenAI(api_key=api_key)
+        self.client = OpenAI(api_key=api_key) if api_key else None
 
         # Initialize json_file_path as instance variable
         self.json_file_path = json_file_path
 
-        try:
-            # Load employee data from JSON file
-            with open(json_file_path, 'r') as file:
-                self.employees = json.load(file)
-        except FileNotFoundError:
-            raise FileNotFoundError(f"Employee data file not found: {json_file_path}")
-        except json.JSONDecodeError:
-            raise ValueError(f"Invalid JSON format in file: {json_file_path}")
-
-        # Store leave history
-        self.leave_history = {name: [] for name in self.employees.keys()}
+        # Employee balances and leave history live in a pluggable storage backend
+        if store is None:
+            store = JsonFileStore(json_file_path, journal=journal, compact_threshold=compact_threshold)
+        self.store = store
+        self.employees = store.employees
+        self.leave_history = store.leave_history
+
+        # Overlap checks go through a selectable engine (see OVERLAP_ENGINES)
+        if overlap_engine not in OVERLAP_ENGINES:
+            raise ValueError(f"Invalid overlap engine: {overlap_engine}. "
+                             f"Use one of: {', '.join(OVERLAP_ENGINES)}")
+        self.overlap = OVERLAP_ENGINES[overlap_engine](store)
+
+        # Org-wide "who is off" index, built on first use
+        self.calendar = LeaveCalendar(store)
+
+        # Shared, memoizing parser for every date the system accepts
+        self.dates = DateParser()
+
+        # Local grammar tried before the LLM for common queries
+        self.intent_parser = RuleIntentParser()
+
+        # LLM answers are checked against QUERY_SCHEMA; failures are counted in llm_stats
+        self._validate_response = compile_validator(self.QUERY_SCHEMA)
+        self.llm_stats = LLMStats()
+        self.prompt = PROMPT_TEMPLATES[self.PROMPT_VERSION]
+
+        # Queries the rule parser cannot read go to a selectable backend (see NLU_BACKENDS)
+        if nlu_backend is None:
+            nlu_backend = "openai" if self.client is not None else "local"
+        if nlu_backend not in NLU_BACKENDS:
+            raise ValueError(f"Invalid NLU backend: {nlu_backend}. Use one of: {', '.join(NLU_BACKENDS)}")
+        self.nlu = NLU_BACKENDS[nlu_backend](self)
+
+        # Repeated phrasings reuse earlier LLM answers
+        if intent_cache is None:
+            intent_cache = IntentCache(json_file_path + ".intents")
+        self.intent_cache = intent_cache
 
     def validate_and_format_date(self, date_str: str) -> tuple[bool, str]:
         """Validate and format date strings, handling 'today' and various formats."""
-        try:
-            if date_str.lower() == 'today':
-                return True, datetime.now().strftime("%Y-%m-%d")
-
-            # Try various date formats
-            for fmt in ["%Y-%m-%d", "%Y.%m.%d", "%d-%m-%Y", "%d.%m.%Y"]:
-                try:
-                    date_obj = datetime.strptime(date_str, fmt)
-                    return True, date_obj.strftime("%Y-%m-%d")  # Convert to standard format
-                except ValueError:
-                    continue
-
-            return False, "Invalid date format. Please use YYYY-MM-DD, YYYY.MM.DD, DD-MM-YYYY, DD.MM.YYYY or 'today'"
-        except Exception:
-            return False, "Invalid date format. Please use YYYY-MM-DD, YYYY.MM.DD, DD-MM-YYYY, DD.MM.YYYY or 'today'"
+        ordinal = self.dates.parse(date_str)
+        if ordinal is None:
+            return False, self.INVALID_DATE_MESSAGE
+        return True, format_ordinal(ordinal)
 
     def check_leave_overlap(self, employee_name: str, new_start_date: str, days: int) -> bool:
         """
         Check if a new leave request overlaps with existing approved leaves.
         Returns True if there is an overlap, False otherwise.
         """
-        # Convert new leave dates to datetime objects
-        new_start = datetime.strptime(new_start_date, "%Y-%m-%d")
-        new_end = new_start + timedelta(days=days - 1)  # -1 because start day counts as first day
+        new_start = self.dates.parse(new_start_date)
+        if new_start is None:
+            raise ValueError(self.INVALID_DATE_MESSAGE)
+        return self.overlap.has_overlap(employee_name, new_start, leave_end_ordinal(new_start, days))
 
-        # Check against existing approved leaves
-        for leave in self.leave_history[employee_name]:
-            if leave["status"] != "approved":
-                continue
+    def process_natural_language(self, user_input: str, employee_name: str) -> list[dict]:
+        """
+        Process natural language input, locally when the query is unambiguous and with OpenAI otherwise.
+        Returns the query's intents in the order they should be carried out.
+        """
+        intents, key = self._resolve_without_llm(user_input, employee_name)
+        if intents is not None:
+            return intents
+        intents = self.nlu.parse(user_input, employee_name)
+        if key is not None:
+            self._remember_intents(key, intents)
+        return intents
+
+    def _resolve_without_llm(self, user_input: str, employee_name: str) -> tuple[list[dict] | None, str | None]:
+        """
+        Return (intents from the local parser or the cache, or None; cache key for the backend's answer,
+        or None if the backend is not cached).
+        """
+        intent, confidence = self.intent_parser.parse(user_input)
+        if intent is not None and confidence >= self.LOCAL_INTENT_CONFIDENCE:
+            return [intent], None
+        if not self.nlu.cacheable:
+            return None, None
+
+        # Answers depend on the prompt, so each prompt version has its own entries
+        key = self.prompt.version + "|" + self.intent_cache.key(user_input, employee_name, self.dates.today())
+        return self.intent_cache.get(key), key
+
+    def _remember_intents(self, key: str, intents: list[dict], save: bool = True):
+        """Cache an LLM answer. Errors may be transient (network, rate limits); only real answers are kept."""
+        if all(intent.get("intent") != "error" for intent in intents):
+            self.intent_cache.put(key, intents, save)
+
+    def _llm_messages(self, user_input: str, employee_name: str) -> list[dict]:
+        """
+        Return the chat messages that ask the LLM to extract an intent from a query.
+        Only the instructions and examples of the intents the local pre-classifier
+        considers likely are sent; unclear queries get the full prompt.
+        """
+        intents = self.intent_parser.likely_intents(user_input)
+        self.llm_stats.count("full_prompts" if intents is None else "selected_prompts")
+        return self.prompt.messages(user_input, employee_name, intents)
+
+    def _llm_request(self, user_input: str, employee_name: str) -> dict:
+        """Return the chat completion parameters that extract an intent from a query."""
+        return {
+            "model": self.LLM_MODEL,
+            "messages": self._llm_messages(user_input, employee_name),
+            "temperature": 0.1,  # Low temperature for consistent categorization
+            "response_format": self.RESPONSE_FORMAT
+        }
 
-            existing_start = datetime.strptime(leave["start_date"], "%Y-%m-%d")
-            existing_end = existing_start + timedelta(days=leave["days"] - 1)
+    def _parse_llm_response(self, content: str | None, refusal: str | None = None) -> list[dict]:
+        """
+        Decode and validate the LLM's answer against QUERY_SCHEMA, counting every failure.
+        Returns the intents, or a single error intent if any of them is unusable.
+        """
+        self.llm_stats.count("responses")
+        if refusal:
+            self.llm_stats.count("refusals")
+            return [{"intent": "error", "message": f"Request declined: {refusal}"}]
+        try:
+            parsed_response = json.loads(content)
+        except (TypeError, ValueError) as e:
+            self.llm_stats.count("json_errors")
+            return [{"intent": "error", "message": f"Error processing request: {str(e)}"}]
+        error = self._validate_response(parsed_response)
+        if error:
+            self.llm_stats.count("schema_errors")
+            return [{"intent": "error", "message": f"Error processing request: {error}"}]
+
+        # Drop the nulls of absent fields so intents keep their usual shape
+        intents = [
+            self._check_intent({key: value for key, value in intent.items() if value is not None})
+            for intent in parsed_response["intents"]
+        ]
+        errors = [intent for intent in intents if intent["intent"] == "error"]
+        if errors:
+            return errors[:1]
+        return intents or [{"intent": "unknown"}]
+
+    def _check_intent(self, parsed_response: dict) -> dict:
+        """Return one decoded intent, or an error intent if its leave type or fields are unusable."""
+        # A balance question without a leave type (a null in the structured output) asks about all of them
+        if parsed_response.get("intent") == "check_balance" and "leave_type" not in parsed_response:
+            parsed_response = {**parsed_response, "leave_type": "all"}
+
+        # Validate leave types
+        if "leave_type" in parsed_response:
+            if isinstance(parsed_response["leave_type"], list):
+                # For multiple leave type requests
+                for leave_type in parsed_response["leave_type"]:
+                    if leave_type not in self.LEAVE_TYPES:
+                        return {
+                            "intent": "error",
+                            "message": f"Invalid leave type: {leave_type}"
+                        }
+            elif parsed_response["leave_type"] != "all" and parsed_response["leave_type"] not in self.LEAVE_TYPES:
+                return {
+                    "intent": "error",
+                    "message": f"Invalid leave type. Available types are: {', '.join(self.LEAVE_TYPES)}"
+                }
 
-            # Check for overlap
-            if (new_start <= existing_end and existing_start <= new_end):
-                return True
+        # Validate required fields for leave requests
+        if parsed_response.get("intent") == "request_leave":
+            required_fields = ["leave_type", "days", "start_date"]
+            missing_fields = [field for field in required_fields if field not in parsed_response]
+            if missing_fields:
+                return {
+                    "intent": "error",
+                    "message": f"Missing required information: {', '.join(missing_fields)}"
+                }
 
-        return False
+        # Validate required fields for cancel requests
+        if parsed_response.get("intent") == "cancel_leave":
+            required_fields = ["leave_type", "start_date"]
+            missing_fields = [field for field in required_fields if field not in parsed_response]
+            if missing_fields:
+                return {
+                    "intent": "error",
+                    "message": f"Missing required information for cancellation: {', '.join(missing_fields)}"
+                }
 
-    def process_natural_language(self, user_input: str, employee_name: str) -> dict:
-        """Process natural language input using OpenAI API."""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """
-                        You are a leave management assistant that handles leave requests and balance queries.
-
-                        Available leave types:
-                        - Sick Leave (includes medical leave, health-related absence, doctor visits)
-                        - Annual Leave (includes vacation, holiday, personal time, time off)
-                        - Maternity Leave (includes pregnancy leave, parental leave)
-
-                        Date formats accepted:
-                        - "today"
-                        - YYYY-MM-DD
-                        - YYYY.MM.DD
-                        - DD-MM-YYYY
-                        - DD.MM.YYYY
-
-                        Extract the following from user queries:
-
-                        1. For balance checks:
-                        a) ALL leave balances:
-                           - "Show all my leave balances"
-                           - "How many leaves do I have?"
-                           → {"intent": "check_balance", "leave_type": "all"}
-
-                        b) SPECIFIC leave types:
-                           - "How many sick days left?"
-                           → {"intent": "check_balance", "leave_type": "Sick Leave"}
-
-                        c) MULTIPLE SPECIFIC types:
-                           - "Show my sick and annual leave"
-                           → {"intent": "check_balance", "leave_type": ["Sick Leave", "Annual Leave"]}
-
-                        2. For leave requests:
-                        - Intent: "request_leave"
-                        - Leave Type: map to one of the three standard types
-                        - Days: positive integer
-                        - Start Date: Parse any supported date format
-                        Examples: 
-                        - "I want 3 days sick leave starting today"
-                        → {"intent": "request_leave", "leave_type": "Sick Leave", "days": 3, "start_date": "today"}
-                        - "Book annual leave for 2 days from 15.01.2024"
-                        → {"intent": "request_leave", "leave_type": "Annual Leave", "days": 2, "start_date": "15.01.2024"}
-
-                        3. For cancellations:
-                        Extract these fields:
-                        - Intent: "cancel_leave"
-                        - Leave Type: map to standard type
-                        - Start Date: Parse any supported date format
-
-                        Example cancellation requests:
-                        - "Cancel my sick leave for today"
-                        → {"intent": "cancel_leave", "leave_type": "Sick Leave", "start_date": "today"}
-                        - "Cancel annual leave starting 15.01.2024"
-                        → {"intent": "cancel_leave", "leave_type": "Annual Leave", "start_date": "15.01.2024"}
-
-                        4. For viewing history:
-                        - Intent: "view_history"
-
-                        Always map varied terms to standard types:
-                        - Medical/health/doctor → "Sick Leave"
-                        - Vacation/holiday/personal → "Annual Leave"
-                        - Pregnancy/parental → "Maternity Leave"
-                        """
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Employee context: {employee_name}. Query: {user_input}"
-                    }
-                ],
-                temperature=0.1  # Low temperature for consistent categorization
-            )
+        return parsed_response
 
-            parsed_response = json.loads(response.choices[0].message.content)
-
-            # Validate leave types
-            if "leave_type" in parsed_response:
-                if isinstance(parsed_response["leave_type"], list):
-                    # For multiple leave type requests
-                    for leave_type in parsed_response["leave_type"]:
-                        if leave_type not in self.LEAVE_TYPES:
-                            return {
-                                "intent": "error",
-                                "message": f"Invalid leave type: {leave_type}"
-                            }
-                elif parsed_response["leave_type"] != "all" and parsed_response["leave_type"] not in self.LEAVE_TYPES:
-                    return {
-                        "intent": "error",
-                        "message": f"Invalid leave type. Available types are: {', '.join(self.LEAVE_TYPES)}"
-                    }
-
-            # Validate required fields for leave requests
-            if parsed_response.get("intent") == "request_leave":
-                required_fields = ["leave_type", "days", "start_date"]
-                missing_fields = [field for field in required_fields if field not in parsed_response]
-                if missing_fields:
-                    return {
-                        "intent": "error",
-                        "message": f"Missing required information: {', '.join(missing_fields)}"
-                    }
-
-            # Validate required fields for cancel requests
-            if parsed_response.get("intent") == "cancel_leave":
-                required_fields = ["leave_type", "start_date"]
-                missing_fields = [field for field in required_fields if field not in parsed_response]
-                if missing_fields:
-                    return {
-                        "intent": "error",
-                        "message": f"Missing required information for cancellation: {', '.join(missing_fields)}"
-                    }
+    def execute_intent(self, employee_name: str, intent: dict) -> str:
+        """Carry out an intent returned by `process_natural_language` and return the reply."""
+        reply, changed = self._execute_intent(employee_name, intent)
+        if changed and not self.save_state():
+            return self.SAVE_ERROR_MESSAGE
+        return reply
 
-            return parsed_response
+    def execute_intents(self, employee_name: str, intents: Sequence[dict]) -> str:
+        """
+        Carry out the intents of one query in order, all or nothing, and return the replies.
+        If any step would fail, nothing is changed and the reply names the failing step.
+        """
+        reply, changed = self._execute_intents(employee_name, intents)
+        if changed and not self.save_state():
+            return self.SAVE_ERROR_MESSAGE
+        return reply
 
-        except Exception as e:
-            return {"intent": "error", "message": f"Error processing request: {str(e)}"}
+    def apply_intents(self, intents: Iterable[tuple[str, Sequence[dict]]]) -> list[str]:
+        """
+        Carry out the intents of many (employee, intents) queries in order, each all or nothing,
+        and persist the result with a single commit.
+        """
+        replies = []
+        changed_queries = []
+        for employee_name, employee_intents in intents:
+            reply, changed = self._execute_intents(employee_name, employee_intents)
+            if changed:
+                changed_queries.append(len(replies))
+            replies.append(reply)
+        if changed_queries and not self.save_state():
+            for index in changed_queries:
+                replies[index] = self.SAVE_ERROR_MESSAGE
+        return replies
+
+    def _execute_intents(self, employee_name: str, intents: Sequence[dict]) -> tuple[str, bool]:
+        """Carry out a query's intents without persisting them. Returns (reply, whether anything changed)."""
+        if len(intents) == 1:
+            return self._execute_intent(employee_name, intents[0])
+
+        errors = [intent["message"] for intent in intents if intent.get("intent") == "error"]
+        if errors:
+            return errors[0], False
+
+        # Plan and apply under one hold of the employee's lock, so the plan stays valid
+        with self.store.lock_for(employee_name):
+            error = self._plan_intents(employee_name, intents)
+            if error:
+                return f"Nothing was changed. {error}", False
+            replies = []
+            changed_any = False
+            for intent in intents:
+                reply, changed = self._execute_intent(employee_name, intent)
+                replies.append(reply)
+                changed_any = changed_any or changed
+        return "\n".join(replies), changed_any
+
+    def _plan_intents(self, employee_name: str, intents: Sequence[dict]) -> str | None:
+        """
+        Dry-run a sequence of intents against a copy of the employee's balances and approved
+        leaves, with the same checks as `request_leave` and `cancel_leave`; every step, read-only
+        ones included, must be complete and name valid leave types. Returns the error of the
+        first step that would fail, or None if every step would succeed.
+        """
+        if employee_name not in self.employees:
+            return f"Employee {employee_name} not found."
+        balances = dict(self.employees[employee_name])
+        approved = [
+            (leave["type"], leave["start"], leave["end"], leave["days"])
+            for leave in self.store.find_leaves(employee_name, "approved")
+        ]
+
+        for step, intent in enumerate(intents, 1):
+            error = self._intent_error(intent)
+            if error:
+                return f"Step {step}: {error}"
+            kind = intent["intent"]
+            if kind == "check_balance" and intent["leave_type"] != "all":
+                leave_types = intent["leave_type"]
+                for leave_type in leave_types if isinstance(leave_types, list) else [leave_types]:
+                    if leave_type not in balances:
+                        return f"Step {step}: Invalid leave type: {leave_type}"
+            elif kind == "request_leave":
+                leave_type, days = intent["leave_type"], intent["days"]
+                error, start = self._validate_request(employee_name, leave_type, days, intent["start_date"])
+                if error:
+                    return f"Step {step}: {error}"
+                end = leave_end_ordinal(start, days)
+                if balances[leave_type] < days:
+                    return (f"Step {step}: Insufficient {leave_type} balance. "
+                            f"You would have {balances[leave_type]} days available.")
+                if any(other_start <= end and start <= other_end for _, other_start, other_end, _ in approved):
+                    return f"Step {step}: Cannot approve leave: You already have approved leave during this period."
+                balances[leave_type] -= days
+                approved.append((leave_type, start, end, days))
+            elif kind == "cancel_leave":
+                leave_type = intent["leave_type"]
+                if leave_type not in self.LEAVE_TYPES:
+                    return f"Step {step}: Invalid leave type: {leave_type}"
+                start = self.dates.parse(intent["start_date"])
+                if start is None:
+                    return f"Step {step}: {self.INVALID_DATE_MESSAGE}"
+                leave = next((leave for leave in approved if leave[0] == leave_type and leave[1] == start), None)
+                if leave is None:
+                    return f"Step {step}: No approved {leave_type} found starting on {format_ordinal(start)}"
+                approved.remove(leave)
+                balances[leave_type] += leave[3]
+        return None
+
+    def _intent_error(self, intent: dict) -> str | None:
+        """Return why an intent cannot be carried out as given (an error, unknown or incomplete intent), or None."""
+        kind = intent.get("intent")
+        if kind == "error":
+            return intent["message"]
+        if kind not in self.INTENT_FIELDS:
+            return "I couldn't process your request. Please try again."
+        missing_fields = [field for field in self.INTENT_FIELDS[kind] if field not in intent]
+        if missing_fields:
+            return f"Missing required information: {', '.join(missing_fields)}"
+        return None
+
+    def _execute_intent(self, employee_name: str, intent: dict) -> tuple[str, bool]:
+        """Carry out an intent without persisting it. Returns (reply, whether anything changed)."""
+        error = self._intent_error(intent)
+        if error:
+            return error, False
+        elif intent.get("intent") == "check_balance":
+            return self.check_leave_balance(employee_name, intent["leave_type"]), False
+        elif intent.get("intent") == "request_leave":
+            return self._request_leave(employee_name, intent["leave_type"], intent["days"], intent["start_date"])
+        elif intent.get("intent") == "cancel_leave":
+            return self._cancel_leave(employee_name, intent["leave_type"], intent["start_date"])
+        # view_history is the only intent left
+        return self.view_history(employee_name), False
 
     def check_leave_balance(self, employee_name: str, leave_type: str | list = "all") -> str:
         """Check leave balance for an employee."""
@@ -210,6 +3055,9 @@ class LeaveManagementSystem:
 
         # Handle multiple specific leave types
         if isinstance(leave_type, list):
+            invalid = [lt for lt in leave_type if lt not in balance]
+            if invalid:
+                return f"Invalid leave type: {invalid[0]}"
             return f"Leave balance for {employee_name}:\n" + \
                 "\n".join([f"- {lt}: {balance[lt]} days" for lt in leave_type])
 
@@ -223,98 +3071,168 @@ class LeaveManagementSystem:
         return f"Current leave balance for {employee_name}:\n" + \
             "\n".join([f"- {lt}: {balance[lt]} days" for lt in balance.keys()])
 
-    def request_leave(self, employee_name: str, leave_type: str, days: int, start_date: str) -> str:
-        """Process a leave request with overlap checking."""
+    def _validate_request(self, employee_name: str, leave_type: str, days: int,
+                          start_date: str) -> tuple[str | None, int | None]:
+        """Check the fields of a leave request. Returns (error message or None, start day ordinal)."""
         if employee_name not in self.employees:
-            return f"Employee {employee_name} not found."
+            return f"Employee {employee_name} not found.", None
 
         if leave_type not in self.employees[employee_name]:
-            return f"Invalid leave type: {leave_type}"
+            return f"Invalid leave type: {leave_type}", None
 
-        # Validate and format date
-        is_valid, result = self.validate_and_format_date(start_date)
-        if not is_valid:
-            return result
-        start_date = result
+        # Dates are converted to day ordinals once; everything after compares integers
+        start = self.dates.parse(start_date)
+        if start is None:
+            return self.INVALID_DATE_MESSAGE, None
 
         if not isinstance(days, (int, float)) or days <= 0:
-            return "Number of days must be a positive number."
+            return "Number of days must be a positive number.", start
+
+        return None, start
 
+    def _approve_leave(self, employee_name: str, leave_type: str, days: int, start: int, end: int) -> str | None:
+        """
+        Check balance and overlaps and record an approved leave. Returns an error message or None.
+        The caller holds the employee's store lock and commits afterwards.
+        """
         current_balance = self.employees[employee_name][leave_type]
         if current_balance < days:
             return f"Insufficient {leave_type} balance. You have {current_balance} days available."
 
         # Check for overlapping leaves
-        if self.check_leave_overlap(employee_name, start_date, days):
+        if self.overlap.has_overlap(employee_name, start, end):
             return f"Cannot approve leave: You already have approved leave during this period."
 
         # Process leave request
-        self.employees[employee_name][leave_type] -= days
+        self.store.set_balance(employee_name, leave_type, current_balance - days)
 
         # Record in history
         leave_record = {
             "type": leave_type,
             "days": days,
-            "start_date": start_date,
+            "start": start,
+            "end": end,
             "status": "approved",
-            "request_date": datetime.now().strftime("%Y-%m-%d")
+            "requested": self.dates.today()
         }
-        self.leave_history[employee_name].append(leave_record)
+        self.store.add_leave(employee_name, leave_record)
+        self.overlap.add(employee_name, start, end)
+        self.calendar.add(employee_name, start, end)
+        return None
 
-        # Save updated state
-        self.save_state()
+    def request_leave(self, employee_name: str, leave_type: str, days: int, start_date: str) -> str:
+        """Process a leave request with overlap checking."""
+        reply, changed = self._request_leave(employee_name, leave_type, days, start_date)
+        # Save updated state; with group commit this waits for the batch holding this change
+        if changed and not self.save_state():
+            return self.SAVE_ERROR_MESSAGE
+        return reply
 
-        return f"Leave request approved. {days} days of {leave_type} starting from {start_date}."
+    def _request_leave(self, employee_name: str, leave_type: str, days: int, start_date: str) -> tuple[str, bool]:
+        """Apply a leave request without persisting it. Returns (reply, whether anything changed)."""
+        error, start = self._validate_request(employee_name, leave_type, days, start_date)
+        if error:
+            return error, False
 
-    def cancel_leave(self, employee_name: str, leave_type: str, start_date: str) -> str:
-        """Cancel a previously approved leave request."""
-        if employee_name not in self.employees:
-            return f"Employee {employee_name} not found."
+        end = leave_end_ordinal(start, days)
 
-        if leave_type not in self.LEAVE_TYPES:
-            return f"Invalid leave type: {leave_type}"
+        # Check and update under the employee's lock so concurrent requests cannot double-book
+        with self.store.lock_for(employee_name):
+            error = self._approve_leave(employee_name, leave_type, days, start, end)
+        if error:
+            return error, False
 
-        # Validate and format date
-        is_valid, result = self.validate_and_format_date(start_date)
-        if not is_valid:
-            return result
-        start_date = result
-
-        # Find all approved leaves for the employee
-        approved_leaves = [
-            (index, leave) for index, leave in enumerate(self.leave_history[employee_name])
-            if leave["status"] == "approved"
-        ]
+        return f"Leave request approved. {days} days of {leave_type} starting from {format_ordinal(start)}.", True
 
-        if not approved_leaves:
-            return f"No approved leaves found for {employee_name}"
+    def bulk_request_leave(self, requests: Iterable[tuple[str, str, int, str]]) -> list[dict]:
+        """
+        Apply many (employee, leave type, days, start date) requests and persist them once.
+
+        Rows are checked exactly like `request_leave`, in submission order per employee,
+        so a row is rejected if it overlaps an earlier accepted row of the same batch or
+        the balance left after earlier rows is too low. Rows are grouped by employee so
+        each employee's lock is taken once. Returns one report per row, in input order,
+        with "row", "employee", "accepted" and "message" keys; if the batch cannot be
+        saved, accepted rows carry the save error as their message.
+        """
+        report = []
+        by_employee = {}
+        for row, (employee_name, leave_type, days, start_date) in enumerate(requests):
+            error, start = self._validate_request(employee_name, leave_type, days, start_date)
+            report.append({"row": row, "employee": employee_name, "accepted": False, "message": error})
+            if error is None:
+                by_employee.setdefault(employee_name, []).append(
+                    (row, leave_type, days, start, leave_end_ordinal(start, days))
+                )
+
+        for employee_name, rows in by_employee.items():
+            with self.store.lock_for(employee_name):
+                for row, leave_type, days, start, end in rows:
+                    error = self._approve_leave(employee_name, leave_type, days, start, end)
+                    report[row]["accepted"] = error is None
+                    report[row]["message"] = error or (
+                        f"Leave request approved. {days} days of {leave_type} "
+                        f"starting from {format_ordinal(start)}."
+                    )
+
+        if by_employee and not self.save_state():
+            for entry in report:
+                if entry["accepted"]:
+                    entry["message"] = self.SAVE_ERROR_MESSAGE
+        return report
 
-        # Find matching leave request
-        matching_leaves = [
-            (idx, leave) for idx, leave in approved_leaves
-            if leave["type"] == leave_type and leave["start_date"] == start_date
-        ]
+    def cancel_leave(self, employee_name: str, leave_type: str, start_date: str) -> str:
+        """Cancel a previously approved leave request."""
+        reply, changed = self._cancel_leave(employee_name, leave_type, start_date)
+        if changed and not self.save_state():
+            return self.SAVE_ERROR_MESSAGE
+        return reply
 
-        if not matching_leaves:
-            # If no exact match, show available leaves that could be cancelled
-            available_leaves = [
-                f"- {leave['type']} starting {leave['start_date']} ({leave['days']} days)"
-                for _, leave in approved_leaves
-            ]
+    def _cancel_leave(self, employee_name: str, leave_type: str, start_date: str) -> tuple[str, bool]:
+        """Cancel a leave without persisting it. Returns (reply, whether anything changed)."""
+        if employee_name not in self.employees:
+            return f"Employee {employee_name} not found.", False
 
-            return (f"No approved {leave_type} found starting on {start_date}\n"
-                    f"Available leaves that can be cancelled:\n" +
-                    "\n".join(available_leaves))
+        if leave_type not in self.LEAVE_TYPES:
+            return f"Invalid leave type: {leave_type}", False
 
-        # Cancel the leave and restore the balance
-        index, leave_to_cancel = matching_leaves[0]
-        self.employees[employee_name][leave_type] += leave_to_cancel["days"]
-        self.leave_history[employee_name][index]["status"] = "cancelled"
-        self.save_state()
+        # Validate and format date
+        start = self.dates.parse(start_date)
+        if start is None:
+            return self.INVALID_DATE_MESSAGE, False
+        start_date = format_ordinal(start)
+
+        with self.store.lock_for(employee_name):
+            # Find matching leave request
+            matching_leaves = self.store.find_leaves(employee_name, "approved", leave_type, start)
+
+            if not matching_leaves:
+                # Find all approved leaves for the employee
+                approved_leaves = self.store.find_leaves(employee_name, "approved")
+                if not approved_leaves:
+                    return f"No approved leaves found for {employee_name}", False
+
+                # If no exact match, show available leaves that could be cancelled
+                available_leaves = [
+                    f"- {leave['type']} starting {format_ordinal(leave['start'])} ({leave['days']} days)"
+                    for leave in approved_leaves
+                ]
+
+                return (f"No approved {leave_type} found starting on {start_date}\n"
+                        f"Available leaves that can be cancelled:\n" +
+                        "\n".join(available_leaves)), False
+
+            # Cancel the leave and restore the balance
+            leave_to_cancel = matching_leaves[0]
+            updated_balance = self.employees[employee_name][leave_type] + leave_to_cancel["days"]
+            self.store.set_balance(employee_name, leave_type, updated_balance)
+            self.store.set_leave_status(employee_name, leave_to_cancel, "cancelled")
+            self.overlap.remove(employee_name, leave_to_cancel["start"], leave_to_cancel["end"])
+            self.calendar.remove(employee_name, leave_to_cancel["start"], leave_to_cancel["end"])
 
         return (f"Successfully cancelled {leave_to_cancel['days']} days of {leave_type} "
                 f"starting from {start_date}. Updated {leave_type} balance: "
-                f"{self.employees[employee_name][leave_type]} days.")
+                f"{updated_balance} days."), True
 
     def view_history(self, employee_name: str) -> str:
         """View leave history for an employee with improved formatting."""
@@ -335,25 +3253,238 @@ class LeaveManagementSystem:
         if approved_leaves:
             response.append("\nApproved Leaves:")
             for record in approved_leaves:
-                response.append(f"- {record['type']}: {record['days']} days from {record['start_date']}")
+                response.append(f"- {record['type']}: {record['days']} days from {format_ordinal(record['start'])}")
 
         if cancelled_leaves:
             response.append("\nCancelled Leaves:")
             for record in cancelled_leaves:
-                response.append(f"- {record['type']}: {record['days']} days from {record['start_date']}")
+                response.append(f"- {record['type']}: {record['days']} days from {format_ordinal(record['start'])}")
 
         if not (approved_leaves or cancelled_leaves):
             response.append("\nNo leave records found.")
 
         return "\n".join(response)
 
-    def save_state(self):
-        """Save the current state of employees back to the JSON file."""
+    def employees_on_leave(self, start_date: str, end_date: str | None = None) -> set[str]:
+        """Return the employees on approved leave on a date, or on any day of a date range."""
+        dates = []
+        for date_str in (start_date, end_date or start_date):
+            ordinal = self.dates.parse(date_str)
+            if ordinal is None:
+                raise ValueError(self.INVALID_DATE_MESSAGE)
+            dates.append(ordinal)
+        return self.calendar.on_leave(dates[0], dates[1])
+
+    def save_state(self) -> bool:
+        """Persist all changes made since the last save through the storage backend."""
+        return self.store.commit()
+
+    def compact(self) -> bool:
+        """Rewrite the persisted state in its most compact form."""
+        return self.store.compact()
+
+
+class AsyncQueryPipeline:
+    """
+    Serve many concurrent employee conversations from one event loop.
+
+    LLM calls go through AsyncOpenAI, bounded by a semaphore and a per-call timeout,
+    so in-flight requests cost a coroutine rather than a thread. The business methods
+    stay synchronous and run in worker threads under the store's locks; each employee's
+    queries are handled one at a time, in arrival order.
+    """
+
+    def __init__(self, lms: LeaveManagementSystem, client: AsyncOpenAI | None = None,
+                 max_concurrency: int = 100, timeout: float = 30.0):
+        self.lms = lms
+        if client is None and isinstance(lms.nlu, OpenAIBackend):
+            client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = client
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._employee_locks = {}
+
+    async def process_natural_language(self, user_input: str, employee_name: str) -> list[dict]:
+        """Async counterpart of `LeaveManagementSystem.process_natural_language`."""
+        intents, key = self.lms._resolve_without_llm(user_input, employee_name)
+        if intents is not None:
+            return intents
+        # Offline backends answer in microseconds; only LLM calls need the event loop
+        if not isinstance(self.lms.nlu, OpenAIBackend):
+            return self.lms.nlu.parse(user_input, employee_name)
+
         try:
-            with open(self.json_file_path, 'w') as file:
-                json.dump(self.employees, file, indent=4)
+            async with self._semaphore:
+                response = await asyncio.wait_for(
+                    self.client.chat.completions.create(**self.lms._llm_request(user_input, employee_name)),
+                    self.timeout
+                )
+            self.lms.llm_stats.record_usage(getattr(response, "usage", None))
+            message = response.choices[0].message
+            intents = self.lms._parse_llm_response(message.content, getattr(message, "refusal", None))
+        except asyncio.TimeoutError:
+            return [{
+                "intent": "error",
+                "message": f"Error processing request: no answer within {self.timeout} seconds"
+            }]
         except Exception as e:
-            print(f"Error saving state: {str(e)}")
+            return [{"intent": "error", "message": f"Error processing request: {str(e)}"}]
+
+        # Persisting the cache touches the disk; keep it off the event loop
+        await asyncio.to_thread(self.lms._remember_intents, key, intents)
+        return intents
+
+    async def handle_query(self, user_input: str, employee_name: str) -> str:
+        """Understand and carry out one query, returning the reply."""
+        lock = self._employee_locks.setdefault(employee_name, asyncio.Lock())
+        async with lock:
+            intents = await self.process_natural_language(user_input, employee_name)
+            return await asyncio.to_thread(self.lms.execute_intents, employee_name, intents)
+
+    async def handle_queries(self, queries: Iterable[tuple[str, str]]) -> list[str]:
+        """Handle many (employee, query) pairs concurrently. Returns the replies in input order."""
+        return await asyncio.gather(*(self.handle_query(user_input, employee_name)
+                                      for employee_name, user_input in queries))
+
+
+class BatchProcessor:
+    """
+    Process a backlog of free-text requests overnight through the OpenAI Batch API.
+
+    Input is a text file of `employee<TAB>query` lines. Queries the local parser or the
+    intent cache can answer skip the batch; the rest are submitted as one batch job
+    using the same prompt as `process_natural_language`. Once the job finishes, every
+    row's intents are applied in input order and persisted with a single commit.
+    The client is injectable (or pointed at `base_url`) so a mock endpoint can stand in.
+    """
+
+    TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, lms: LeaveManagementSystem, client: OpenAI | None = None,
+                 base_url: str | None = None, poll_interval: float = 60.0):
+        self.lms = lms
+        if client is None:
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url) if base_url else lms.client
+        if client is None:
+            raise ValueError("Batch processing needs OpenAI: set OPENAI_API_KEY or pass a client or base_url")
+        self.client = client
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def read_requests(path: str) -> list[tuple[str, str]]:
+        """Read (employee, query) rows from a tab-separated file, skipping blank lines."""
+        rows = []
+        with open(path, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                employee_name, separator, user_input = line.rstrip("\n").partition("\t")
+                if not separator:
+                    raise ValueError(f"Line {line_number} of {path} is not 'employee<TAB>query'")
+                rows.append((employee_name.strip(), user_input.strip()))
+        return rows
+
+    def build_input(self, rows: Sequence[tuple[int, str, str]]) -> str:
+        """Return the batch input JSONL for (row, employee, query) triples."""
+        lines = []
+        for row, employee_name, user_input in rows:
+            lines.append(json.dumps({
+                "custom_id": f"row-{row}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.lms._llm_request(user_input, employee_name)
+            }))
+        return "\n".join(lines) + "\n"
+
+    def submit(self, rows: Sequence[tuple[int, str, str]]) -> str:
+        """Upload the input file, create the batch job and return its id."""
+        input_file = self.client.files.create(
+            file=("leave_requests.jsonl", self.build_input(rows).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def wait(self, batch_id: str, timeout: float | None = None):
+        """Poll until the batch job reaches a terminal status and return it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in self.TERMINAL_STATUSES:
+                return batch
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout} seconds")
+            time.sleep(self.poll_interval)
+
+    def fetch_intents(self, batch) -> dict[str, list[dict]]:
+        """Return the validated intents of every answered request of a finished batch, by custom_id."""
+        intents = {}
+        for file_id in (batch.error_file_id, batch.output_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    error = result.get("error") or response.get("body", {}).get("error") or {}
+                    intents[result["custom_id"]] = [{
+                        "intent": "error",
+                        "message": f"Error processing request: {error.get('message', 'request failed')}"
+                    }]
+                    continue
+                self.lms.llm_stats.record_usage(response["body"].get("usage"))
+                try:
+                    message = response["body"]["choices"][0]["message"]
+                    intents[result["custom_id"]] = self.lms._parse_llm_response(
+                        message.get("content"), message.get("refusal")
+                    )
+                except Exception as e:
+                    intents[result["custom_id"]] = [
+                        {"intent": "error", "message": f"Error processing request: {str(e)}"}
+                    ]
+        return intents
+
+    def run(self, path: str, timeout: float | None = None) -> list[dict]:
+        """
+        Process every row of `path` and apply the results in one transaction.
+        Returns one report per row with "row", "employee", "query", "intents" and "reply" keys.
+        """
+        rows = self.read_requests(path)
+        intents = [None] * len(rows)
+        keys = [None] * len(rows)
+        pending = []
+        for row, (employee_name, user_input) in enumerate(rows):
+            intents[row], keys[row] = self.lms._resolve_without_llm(user_input, employee_name)
+            if intents[row] is None:
+                pending.append((row, employee_name, user_input))
+
+        if pending:
+            batch = self.wait(self.submit(pending), timeout)
+            if batch.status != "completed" and not (batch.output_file_id or batch.error_file_id):
+                raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+            answers = self.fetch_intents(batch)
+            for row, _, _ in pending:
+                intents[row] = answers.get(f"row-{row}", [{
+                    "intent": "error",
+                    "message": f"Error processing request: no answer (batch {batch.status})"
+                }])
+                if keys[row] is not None:
+                    self.lms._remember_intents(keys[row], intents[row], save=False)
+            self.lms.intent_cache.save()
+
+        replies = self.lms.apply_intents(
+            (employee_name, row_intents) for (employee_name, _), row_intents in zip(rows, intents)
+        )
+        return [
+            {"row": row, "employee": employee_name, "query": user_input, "intents": row_intents, "reply": reply}
+            for row, ((employee_name, user_input), row_intents, reply) in enumerate(zip(rows, intents, replies))
+        ]
 
 
 def main():
@@ -386,6 +3517,14 @@ def main():
                 json.dump(sample_data, file, indent=4)
 
         lms = LeaveManagementSystem("employees.json")
+        if not isinstance(lms.nlu, OpenAIBackend):
+            print("OPENAI_API_KEY is not set; queries are understood by the offline classifier.")
+
+        # Offline mode: python leave_management_system.py --batch requests.tsv
+        if len(sys.argv) == 3 and sys.argv[1] == "--batch":
+            for report in BatchProcessor(lms).run(sys.argv[2]):
+                print(f"[{report['row']}] {report['employee']}: {report['reply']}")
+            return
 
         print("Welcome to the Leave Management System!")
         print("\nAvailable leave types:")
@@ -432,27 +3571,7 @@ def main():
 
             # Process user query
             response = lms.process_natural_language(user_query, employee_name)
-            if response["intent"] == "error":
-                print(response["message"])
-            elif response["intent"] == "check_balance":
-                print(lms.check_leave_balance(employee_name, response["leave_type"]))
-            elif response["intent"] == "request_leave":
-                print(lms.request_leave(
-                    employee_name,
-                    response["leave_type"],
-                    response["days"],
-                    response["start_date"]
-                ))
-            elif response["intent"] == "cancel_leave":
-                print(lms.cancel_leave(
-                    employee_name,
-                    response["leave_type"],
-                    response["start_date"]
-                ))
-            elif response["intent"] == "view_history":
-                print(lms.view_history(employee_name))
-            else:
-                print("I couldn't process your request. Please try again.")
+            print(lms.execute_intents(employee_name, response))
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
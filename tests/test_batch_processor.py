@@ -0,0 +1,140 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from leave_management_system import BatchProcessor, LeaveManagementSystem
+
+
+class FakeBatchClient:
+    """
+    Local stand-in for the `files` and `batches` endpoints of the OpenAI client.
+
+    `answers` maps a phrase to the intent the fake model returns for queries containing
+    it, to ("error", message) for a request-level error in the error file, to
+    ("status", code) for a non-200 response in the output file, or to ("missing",) for a
+    request the batch never got to. After `polls_until_done`
+    retrievals the batch ends with `final_status`.
+    """
+
+    def __init__(self, answers: dict, final_status: str = "completed", polls_until_done: int = 2,
+                 write_files: bool = True):
+        self.answers = answers
+        self.final_status = final_status
+        self.polls_until_done = polls_until_done
+        self.write_files = write_files
+        self.contents = {}
+        self.polls = 0
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _create_file(self, file, purpose):
+        assert purpose == "batch"
+        self.contents["input"] = file[1].decode("utf-8")
+        return SimpleNamespace(id="input")
+
+    def _file_content(self, file_id):
+        return SimpleNamespace(text=self.contents[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        assert input_file_id == "input" and endpoint == "/v1/chat/completions"
+        return SimpleNamespace(id="batch-1")
+
+    def input_requests(self) -> list[dict]:
+        return [json.loads(line) for line in self.contents["input"].splitlines()]
+
+    def _answer(self, request: dict) -> tuple[str, str] | None:
+        query = request["body"]["messages"][-1]["content"]
+        custom_id = request["custom_id"]
+        answer = next(answer for phrase, answer in self.answers.items() if phrase in query)
+        if answer[0] == "missing":
+            return None
+        if answer[0] == "error":
+            return "error", json.dumps({"custom_id": custom_id, "response": None, "error": {"message": answer[1]}})
+        if answer[0] == "status":
+            response = {"status_code": answer[1], "body": {"error": {"message": "server error"}}}
+            return "output", json.dumps({"custom_id": custom_id, "response": response, "error": None})
+        fields = {"leave_type": None, "days": None, "start_date": None, **answer[1]}
+        content = json.dumps({"intents": [{"intent": answer[0], **fields}]})
+        response = {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}
+        return "output", json.dumps({"custom_id": custom_id, "response": response, "error": None})
+
+    def _retrieve_batch(self, batch_id):
+        self.polls += 1
+        if self.polls < self.polls_until_done:
+            return SimpleNamespace(id=batch_id, status="in_progress", output_file_id=None, error_file_id=None)
+        if not self.write_files:
+            return SimpleNamespace(id=batch_id, status=self.final_status, output_file_id=None, error_file_id=None)
+        lines = {"output": [], "error": []}
+        for request in self.input_requests():
+            answer = self._answer(request)
+            if answer is not None:
+                lines[answer[0]].append(answer[1])
+        self.contents.update({file_id: "\n".join(file_lines) for file_id, file_lines in lines.items()})
+        return SimpleNamespace(id=batch_id, status=self.final_status, output_file_id="output", error_file_id="error")
+
+
+class BatchProcessorTest(unittest.TestCase):
+    """Batch mode against a local mock of the Batch API."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        json_path = os.path.join(self.tmp.name, "employees.json")
+        with open(json_path, 'w') as file:
+            json.dump({"Alice": {"Sick Leave": 5, "Annual Leave": 7, "Maternity Leave": 0},
+                       "Bob": {"Sick Leave": 5, "Annual Leave": 7, "Maternity Leave": 0}}, file)
+        self.lms = LeaveManagementSystem(json_path, nlu_backend="local")
+        self.requests_path = os.path.join(self.tmp.name, "requests.tsv")
+        with open(self.requests_path, 'w') as file:
+            file.write("Alice\tPlease book 3 days sick leave from 2025-03-03\n"
+                       "\n"
+                       "Bob\tcould you put me down for a couple of days vacation beginning 10.03.2025\n"
+                       "Alice\tthis one is overloaded\n"
+                       "Bob\tthis one hits a server error\n")
+        self.answers = {
+            "couple of days": ("request_leave", {"leave_type": "Annual Leave", "days": 2, "start_date": "10.03.2025"}),
+            "overloaded": ("error", "model overloaded"),
+            "server error": ("status", 500)
+        }
+
+    def run_batch(self, client: FakeBatchClient) -> list[dict]:
+        return BatchProcessor(self.lms, client=client, poll_interval=0).run(self.requests_path)
+
+    def test_output_and_error_file_rows_are_applied_in_order(self):
+        client = FakeBatchClient(self.answers)
+        commits = []
+        commit = self.lms.store.commit
+        self.lms.store.commit = lambda: commits.append(1) or commit()
+
+        report = self.run_batch(client)
+
+        # The locally parsed row never reaches the batch
+        self.assertEqual([request["custom_id"] for request in client.input_requests()], ["row-1", "row-2", "row-3"])
+        self.assertEqual(client.polls, 2)
+        self.assertEqual([row["employee"] for row in report], ["Alice", "Bob", "Alice", "Bob"])
+        self.assertTrue(report[0]["reply"].startswith("Leave request approved. 3 days of Sick Leave"))
+        self.assertTrue(report[1]["reply"].startswith("Leave request approved. 2 days of Annual Leave"))
+        self.assertEqual(report[2]["reply"], "Error processing request: model overloaded")
+        self.assertEqual(report[3]["reply"], "Error processing request: server error")
+        self.assertEqual(self.lms.employees["Alice"]["Sick Leave"], 2)
+        self.assertEqual(self.lms.employees["Bob"]["Annual Leave"], 5)
+        self.assertEqual(len(commits), 1)
+
+    def test_rows_missing_from_an_unfinished_batch_get_an_error(self):
+        answers = dict(self.answers, **{"couple of days": ("missing",)})
+        report = self.run_batch(FakeBatchClient(answers, final_status="expired"))
+        self.assertEqual(report[1]["reply"], "Error processing request: no answer (batch expired)")
+        self.assertEqual(report[2]["reply"], "Error processing request: model overloaded")
+        self.assertEqual(self.lms.employees["Bob"]["Annual Leave"], 7)
+
+    def test_batch_that_ends_without_results_raises(self):
+        client = FakeBatchClient(self.answers, final_status="failed", write_files=False)
+        with self.assertRaisesRegex(RuntimeError, "ended with status failed"):
+            self.run_batch(client)
+        self.assertEqual(self.lms.employees["Alice"]["Sick Leave"], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+
+from leave_management_system import GroupCommitter
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.001)
+
+
+class CommitThread(threading.Thread):
+    """Calls `committer.commit()` once and keeps its result."""
+
+    def __init__(self, committer: GroupCommitter, name: str):
+        super().__init__(name=name, daemon=True)
+        self.committer = committer
+        self.result = None
+
+    def run(self):
+        self.result = self.committer.commit()
+
+
+class GroupCommitterFailureTest(unittest.TestCase):
+    """Failed flushes must release every caller they cover and report the failure to each."""
+
+    def start(self, committer: GroupCommitter, name: str) -> CommitThread:
+        thread = CommitThread(committer, name)
+        thread.start()
+        return thread
+
+    def join(self, *threads: CommitThread):
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), f"{thread.name} is still waiting")
+
+    def test_followers_are_released_when_the_flush_raises(self):
+        def flush():
+            raise OSError("disk gone")
+
+        committer = GroupCommitter(flush, window=5, max_batch=3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [self.start(committer, f"caller-{i}") for i in range(3)]
+            self.join(*threads)
+        self.assertEqual([thread.result for thread in threads], [False, False, False])
+        self.assertEqual(committer._failed_batches, set())
+        self.assertEqual(committer._waiting, {})
+
+    def test_failed_later_batch_fails_the_earlier_batch_it_covered(self):
+        flushes = []
+        later_flushed = threading.Event()
+
+        def flush():
+            # The later batch flushes first and fails; the earlier leader's own flush then succeeds
+            flushes.append(threading.current_thread().name)
+            later_flushed.set()
+            return len(flushes) > 1
+
+        committer = GroupCommitter(flush, window=5, max_batch=2)
+        flush_lock = committer._flush_lock
+
+        class LetLaterBatchFirst:
+            def __enter__(self):
+                if threading.current_thread().name == "leader-0":
+                    later_flushed.wait(5)
+                flush_lock.acquire()
+
+            def __exit__(self, *exc_info):
+                flush_lock.release()
+
+        committer._flush_lock = LetLaterBatchFirst()
+
+        leader_0 = self.start(committer, "leader-0")
+        wait_until(lambda: committer._open_count == 1)
+        follower_0 = self.start(committer, "follower-0")
+        wait_until(lambda: committer._open_batch == 1)
+        leader_1 = self.start(committer, "leader-1")
+        wait_until(lambda: committer._open_count == 1)
+        follower_1 = self.start(committer, "follower-1")
+        self.join(leader_0, follower_0, leader_1, follower_1)
+
+        self.assertEqual(flushes, ["leader-1", "leader-0"])
+        self.assertFalse(leader_1.result)
+        self.assertFalse(follower_1.result)
+        # Batch 0 was released by the failed flush of batch 1, so its follower saw the failure
+        self.assertFalse(follower_0.result)
+        self.assertTrue(leader_0.result)
+        self.assertEqual(committer._failed_batches, set())
+        self.assertEqual(committer._waiting, {})
+
+    def test_successful_batches_report_success(self):
+        committer = GroupCommitter(lambda: True, window=5, max_batch=4)
+        threads = [self.start(committer, f"caller-{i}") for i in range(4)]
+        self.join(*threads)
+        self.assertEqual([thread.result for thread in threads], [True] * 4)
+        self.assertEqual(committer._waiting, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import leave_management_system as lms_module
+from leave_management_system import HistoryLog, JsonFileStore, LeaveManagementSystem
+
+
+class JsonFileStoreRecoveryTest(unittest.TestCase):
+    """Crash recovery of JsonFileStore: journal records carrying history, redo and rollback."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.json_path = os.path.join(self.tmp.name, "employees.json")
+        with open(self.json_path, 'w') as file:
+            json.dump({"Alice": {"Annual Leave": 10, "Sick Leave": 5},
+                       "Bob": {"Annual Leave": 10, "Sick Leave": 5}}, file)
+
+    def open_system(self, journal: bool = True) -> LeaveManagementSystem:
+        return LeaveManagementSystem(self.json_path, journal=journal, nlu_backend="local")
+
+    def history_lines(self, lms: LeaveManagementSystem, employee_name: str) -> list[str]:
+        path = lms.store.history_log.path_for(employee_name)
+        with open(path, 'r') as file:
+            return file.read().splitlines()
+
+    def test_torn_journal_record_is_dropped(self):
+        lms = self.open_system()
+        lms.request_leave("Alice", "Annual Leave", 2, "2024-03-01")
+        # A crash mid-append leaves a partial record after the last complete one
+        with open(lms.store.journal_path, 'a') as file:
+            file.write('{"s":[["Alice","Annual Leave",1')
+
+        lms = self.open_system()
+        self.assertEqual(lms.employees["Alice"]["Annual Leave"], 8)
+        self.assertEqual(len(lms.leave_history["Alice"]), 1)
+        self.assertEqual(os.path.getsize(lms.store.journal_path), 0)
+        # New records are not appended after the torn one
+        lms.request_leave("Alice", "Annual Leave", 1, "2024-04-01")
+        self.assertEqual(self.open_system().employees["Alice"]["Annual Leave"], 7)
+
+    def test_history_cut_short_by_a_crash_is_redone(self):
+        for journal in (True, False):
+            with self.subTest(journal=journal):
+                self.setUp()
+                lms = self.open_system(journal)
+                # The journal record is written, then the process dies halfway through the history append
+                real_append = lms_module.append_text
+
+                def crash_mid_append(path, text, durability=lms_module.DURABILITY_FILE):
+                    if path.endswith(".hist"):
+                        real_append(path, text[:len(text) // 2], durability)
+                        raise SystemExit("crash")
+                    real_append(path, text, durability)
+
+                with mock.patch.object(lms_module, "append_text", crash_mid_append):
+                    with self.assertRaises(SystemExit):
+                        lms.request_leave("Alice", "Annual Leave", 2, "2024-03-01")
+
+                lms = self.open_system(journal)
+                self.assertEqual(lms.employees["Alice"]["Annual Leave"], 8)
+                records = lms.leave_history["Alice"]
+                self.assertEqual([(r["type"], r["days"], r["status"]) for r in records],
+                                 [("Annual Leave", 2, "approved")])
+                self.assertEqual(len(self.history_lines(lms, "Alice")), 1)
+
+    def test_replaying_written_history_does_not_duplicate_it(self):
+        lms = self.open_system()
+        lms.request_leave("Alice", "Annual Leave", 2, "2024-03-01")
+        lms.cancel_leave("Alice", "Annual Leave", "2024-03-01")
+        lms.request_leave("Alice", "Annual Leave", 1, "2024-04-01")
+
+        for _ in range(2):
+            lms = self.open_system()
+            self.assertEqual(len(self.history_lines(lms, "Alice")), 3)
+            self.assertEqual([r["status"] for r in lms.leave_history["Alice"]], ["cancelled", "approved"])
+            self.assertEqual(lms.employees["Alice"]["Annual Leave"], 9)
+
+    def test_failed_append_is_rolled_back_and_retried(self):
+        lms = self.open_system()
+        lms.request_leave("Alice", "Sick Leave", 1, "2024-02-01")
+        real_append = lms_module.append_text
+        bob_path = lms.store.history_log.path_for("Bob")
+
+        def fail_for_bob(path, text, durability=lms_module.DURABILITY_FILE):
+            if path == bob_path:
+                real_append(path, text[:3], durability)
+                raise OSError("disk full")
+            real_append(path, text, durability)
+
+        lms.store.add_leave("Alice", {"type": "Sick Leave", "days": 1, "start": 738000, "end": 738000,
+                                      "status": "approved", "requested": 738000})
+        lms.store.add_leave("Bob", {"type": "Sick Leave", "days": 1, "start": 738000, "end": 738000,
+                                    "status": "approved", "requested": 738000})
+        with mock.patch.object(lms_module, "append_text", fail_for_bob):
+            self.assertFalse(lms.store.flush())
+        # Alice's lines were written and dropped; Bob's partial line was rolled back and stays pending
+        self.assertEqual(list(lms.store._pending_history), ["Bob"])
+        self.assertEqual(os.path.getsize(bob_path), 0)
+
+        self.assertTrue(lms.store.flush())
+        lms = self.open_system()
+        self.assertEqual(len(self.history_lines(lms, "Alice")), 2)
+        self.assertEqual(len(self.history_lines(lms, "Bob")), 1)
+        self.assertEqual(len(lms.leave_history["Bob"]), 1)
+
+
+class HistoryLogWriteAtTest(unittest.TestCase):
+    """HistoryLog.write_at makes redoing an append idempotent."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.log = HistoryLog(self.tmp.name)
+        self.path = self.log.path_for("Alice")
+
+    def read(self) -> str:
+        with open(self.path, 'r') as file:
+            return file.read()
+
+    def test_write_at_skips_text_already_present(self):
+        self.log.write_at("Alice", "S\t0\tcancelled\n")
+        self.log.write_at("Alice", "S\t0\tcancelled\n", 0)
+        self.assertEqual(self.read(), "S\t0\tcancelled\n")
+
+    def test_write_at_replaces_a_torn_tail(self):
+        self.log.write_at("Alice", "S\t0\tcancelled\n")
+        with open(self.path, 'a') as file:
+            file.write("S\t1\tca")
+        self.log.write_at("Alice", "S\t1\tcancelled\n", len("S\t0\tcancelled\n"))
+        self.assertEqual(self.read(), "S\t0\tcancelled\nS\t1\tcancelled\n")
+
+
+if __name__ == "__main__":
+    unittest.main()